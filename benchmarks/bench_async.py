@@ -0,0 +1,51 @@
+"""bench_async.py
+Compares p50/p99 latency and throughput of the synchronous query.py (under gunicorn) and the
+asyncio async_query.py (under hypercorn) at the same number of workers and concurrent clients.
+Both run without the result cache, so every request reaches Elasticsearch.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, os, subprocess, sys
+from urllib.parse import urlencode
+from load_test import ES_MODULE_DIR, result_urls, run_load, wait_until_up
+
+SERVERS = {
+    'sync': lambda workers, bind: ['-m', 'gunicorn', '-w', str(workers), '-b', bind, 'query:app'],
+    'async': lambda workers, bind: ['-m', 'hypercorn', '-w', str(workers), '-b', bind, 'async_query:app'],
+}
+
+
+def similar_entity_urls(base_url, doc_ids):
+    """ 'More like this' pages, whose reference article and search are independent requests. """
+    return ['%s/results/1?%s' % (base_url, urlencode({'type': 'more_like_this_entities', 'query': doc_id}))
+            for doc_id in doc_ids]
+
+
+def main():
+    base_url = 'http://127.0.0.1:%d' % args.port
+    env = dict(os.environ, CORD19_INDEX_NAME=args.index_name, CORD19_CACHE='none')
+    urls = result_urls(base_url) + similar_entity_urls(base_url, range(args.similar_docs))
+    print('server\treq/sec\tp50 ms\tp99 ms')
+    for name, command in SERVERS.items():
+        server = subprocess.Popen([sys.executable] + command(args.workers, base_url[7:]), cwd=ES_MODULE_DIR, env=env)
+        try:
+            wait_until_up(base_url + '/')
+            throughput, p50, p99 = run_load(urls, args.concurrency, args.requests)
+            print(f'{name}\t{throughput:0.1f}\t{p50 * 1000:0.1f}\t{p99 * 1000:0.1f}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the sync and asyncio query servers")
+    parser.add_argument('--index_name', help="Name of the index (alias) created by index.py",
+                        default="another_covid_index")
+    parser.add_argument('--workers', help="Worker processes per server", type=int, default=2)
+    parser.add_argument('--concurrency', help="Number of concurrent clients", type=int, default=32)
+    parser.add_argument('--requests', help="Number of requests per server", type=int, default=1000)
+    parser.add_argument('--similar_docs', help="Number of document ids used for 'more like this' pages",
+                        type=int, default=20)
+    parser.add_argument('--port', help="Port to serve on", type=int, default=8765)
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,104 @@
+"""bench_highlight.py
+Measures the highlighting cost of result pages: the same searches are run without highlighting,
+with the whole-field highlighting query.py used to do (every hit's abstract re-analyzed at query
+time), and with bounded fragments read from indexed offsets (unified) or term vectors (fvh).
+Papers with long abstracts are indexed once per index.py --highlighting option, into a local
+single-node Elasticsearch; the report is the server-side time per page and the time saved per
+page compared to whole-field highlighting.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, json, random, sys
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch_dsl import Search
+from load_test import ES_MODULE_DIR
+from synthetic import WORDS, make_sentence
+
+# query.py is run as a script from its own directory, and imports its neighbours that way
+sys.path.insert(0, ES_MODULE_DIR)
+import index
+from query import build_search, highlight, SOURCE_FIELDS
+
+# (name, index.py --highlighting, highlighter, abstract fragment size); None does not highlight
+VARIANTS = [('no highlighting', 'none', None, None),
+            ('whole field, re-analyzed', 'none', 'unified', 0),
+            ('fragment, re-analyzed', 'none', 'unified', 300),
+            ('whole field, offsets', 'offsets', 'unified', 0),
+            ('fragment, offsets', 'offsets', 'unified', 300),
+            ('fragment, term vectors (fvh)', 'term_vectors', 'fvh', 300)]
+BASELINE = 'whole field, re-analyzed'
+
+
+def make_papers(n_papers, abstract_sentences, seed=0):
+    rng = random.Random(seed)
+    for i in range(n_papers):
+        yield {"_id": i, "title": make_sentence(rng, rng.randint(6, 15)), "pr": rng.random(), "snippet": "",
+               "abstract": ' '.join(make_sentence(rng, rng.randint(8, 30)) for _ in range(abstract_sentences)),
+               "ents": "", "publish_time": rng.randint(1990, 2020), "in_english": True}
+
+
+def load(es, highlighting):
+    name = '%s_%s' % (args.index_name, highlighting)
+    es.indices.delete(index=name, ignore=[404])
+    index.create_index(name, 'full', highlighting)
+    helpers.bulk(es, make_papers(args.papers, args.abstract_sentences), index=name, chunk_size=500)
+    es.indices.put_settings(index=name, body={"index": {"refresh_interval": "1s"}})
+    es.indices.forcemerge(index=name, max_num_segments=1, request_timeout=3600)
+    es.indices.refresh(index=name)
+    return name
+
+
+def queries(n, seed=1):
+    rng = random.Random(seed)
+    return [' '.join(rng.sample(WORDS, 2)) for _ in range(n)]
+
+
+def main():
+    es = index.es = Elasticsearch([args.es_url], timeout=100)
+    names = {highlighting: load(es, highlighting) for highlighting in sorted(index.HIGHLIGHTING)}
+    texts = queries(args.queries)
+
+    took = {}
+    for variant, highlighting, highlighter, fragment_size in VARIANTS:
+        times = []
+        for repeat in range(args.repeat + 1):
+            for text in texts:
+                s = build_search(Search(), text, '', 0, 99999, 'true', 'or').source(includes=SOURCE_FIELDS['serp'])
+                if highlighter:
+                    s = highlight(s, highlighter, fragment_size)
+                # request_cache is off for searches returning hits, so every run is executed
+                response = es.search(index=names[highlighting], body=s[:args.page_size].to_dict())
+                if repeat:  # the first pass warms up caches and is not counted
+                    times.append(response['took'])
+        took[variant] = sorted(times)
+
+    print(f'{args.papers} papers, {args.abstract_sentences} sentences per abstract, {args.page_size} hits per page')
+    print('variant\tmean ms\tp99 ms\tsaved ms per page')
+    baseline = sum(took[BASELINE]) / len(took[BASELINE])
+    report = {}
+    for variant, times in took.items():
+        mean = sum(times) / len(times)
+        report[variant] = {"mean_ms": mean, "p99_ms": times[int(len(times) * 0.99)], "saved_ms": baseline - mean}
+        print(f'{variant}\t{mean:0.1f}\t{report[variant]["p99_ms"]:0.1f}\t{baseline - mean:0.1f}')
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if not args.keep:
+        for name in names.values():
+            es.indices.delete(index=name, ignore=[404])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark highlighting of result pages by highlighter and mapping")
+    parser.add_argument('--es_url', help="Local single-node Elasticsearch", default='http://127.0.0.1:9200')
+    parser.add_argument('--index_name', help="Prefix of the indices created for the benchmark",
+                        default='cord19_highlight')
+    parser.add_argument('--papers', help="Number of synthetic papers", type=int, default=20000)
+    parser.add_argument('--abstract_sentences', help="Sentences per abstract", type=int, default=40)
+    parser.add_argument('--queries', help="Number of distinct two-word queries", type=int, default=50)
+    parser.add_argument('--page_size', help="Hits per page", type=int, default=10)
+    parser.add_argument('--repeat', help="Times each query is run per variant", type=int, default=5)
+    parser.add_argument('--out', help="JSON file the results are written to", default='highlight.json')
+    parser.add_argument('--keep', help="Keep the benchmark indices", action='store_true')
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,50 @@
+"""bench_mapping.py
+Compares the mapping profiles of index.py (--mapping full / lean) on the same synthetic release:
+index size on disk, hidden nested documents, bytes sent, ingest rate and query latency. Each
+profile is built and queried by run_suite.py against a local single-node Elasticsearch.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, glob, json, os, subprocess, sys, tempfile
+
+PROFILES = ['full', 'lean']
+
+
+def run_profile(mapping, report_dir):
+    """ Runs the benchmark suite with one mapping profile and returns its report. """
+    subprocess.run([sys.executable, 'run_suite.py', '--es_url', args.es_url, '--mapping', mapping,
+                    '--index_name', 'cord19_benchmark_' + mapping, '--papers', str(args.papers),
+                    '--seed', str(args.seed), '--requests', str(args.requests), '--report_dir', report_dir],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    with open(sorted(glob.glob(os.path.join(report_dir, 'build_*.json')))[-1]) as f:
+        return json.load(f)
+
+
+def main():
+    rows = {}
+    for mapping in PROFILES:
+        report = run_profile(mapping, tempfile.mkdtemp(prefix='cord19_mapping_'))
+        rows[mapping] = {"store_mb": report['index']['store_bytes'] / 2 ** 20,
+                         "lucene_docs": report['index']['lucene_docs'],
+                         "sent_mb": report['counters'].get('bulk.bytes_sent', 0) / 2 ** 20,
+                         "docs_per_sec": report['docs_per_sec'],
+                         "search_p50_ms": report['queries']['search']['p50_ms'],
+                         "search_p99_ms": report['queries']['search']['p99_ms']}
+
+    print('profile\tindex MB\tlucene docs\tsent MB\tdocs/sec\tsearch p50 ms\tsearch p99 ms')
+    for mapping, row in rows.items():
+        print(f'{mapping}\t{row["store_mb"]:0.1f}\t{row["lucene_docs"]}\t{row["sent_mb"]:0.1f}\t'
+              f'{row["docs_per_sec"]:0.1f}\t{row["search_p50_ms"]:0.1f}\t{row["search_p99_ms"]:0.1f}')
+    with open(args.out, 'w') as f:
+        json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare index size and ingest rate of the mapping profiles")
+    parser.add_argument('--es_url', help="Local single-node Elasticsearch", default='http://127.0.0.1:9200')
+    parser.add_argument('--papers', help="Number of synthetic papers", type=int, default=5000)
+    parser.add_argument('--seed', help="Random seed of the synthetic release", type=int, default=0)
+    parser.add_argument('--requests', help="Number of queries replayed per profile", type=int, default=500)
+    parser.add_argument('--out', help="JSON file the comparison is written to", default='mapping_profiles.json')
+    args = parser.parse_args()
+    main()
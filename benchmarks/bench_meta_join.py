@@ -0,0 +1,77 @@
+"""bench_meta_join.py
+Compares how the entity/metadata stage of indexing scales with corpus size: the original
+per-document membership check and filtering of the in-memory entity/metadata dict against what
+index.py does now, building the sqlite meta store from the metadata csv and NER files
+(metadata.build_meta_store) and reading each paper's record from it (MetaStore.get).
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, os, shutil, tempfile, time
+from collections import Counter, defaultdict
+import cord_19_ems.es_module.extras as utils
+from cord_19_ems.es_module.index import entity_types
+from cord_19_ems.es_module.metadata import build_meta_store, MetaStore
+from synthetic import make_meta_ner, make_sha, write_dataset
+
+
+def get_entity_counts(meta_ner_all):
+    """ Counts the entities of the metadata collection, cleaning each entity list in place. """
+    ent_freqs = defaultdict(int)
+    for sha, info in meta_ner_all.items():
+        for type, entlist in info['entities'].items():
+            entlist = utils.filter_entities(entlist)
+            meta_ner_all[sha]['entities'][type] = entlist
+            for ent, count in Counter(entlist).items():
+                ent_freqs[ent] += count
+    return ent_freqs
+
+
+def per_document(meta_ner_all, shas):
+    """ The lookup as it was done inside actions() before the join table existed. """
+    ent_freqs = get_entity_counts(meta_ner_all)
+    for sha in shas:
+        if sha in set(meta_ner_all.keys()):
+            ents = []
+            for type, entlist in meta_ner_all[sha]['entities'].items():
+                if type in entity_types:
+                    ents.extend(entlist)
+            ents = [ent for ent in ents if ent_freqs[ent] > 1]
+            utils.untokenize(ents)
+            utils.extract_year(meta_ner_all[sha]["publish_time"])
+
+
+def meta_store(metadata_path, ner_path, shas, out):
+    """ The lookup as index.py does it now: the sqlite store is built from the csv and NER files, then read per sha. """
+    build_meta_store(metadata_path, ner_path, entity_types, out)
+    store = MetaStore(out)
+    for sha in shas:
+        store.get(sha)
+
+
+def main():
+    print('papers\tper_document(s)\tmeta_store(s)')
+    for n in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix='cord19_meta_')
+        # the same entities as make_meta_ner(n), written as a metadata csv and NER file
+        _, metadata_path, ner_path = write_dataset(work_dir, n, paragraphs=1, refs_per_paper=0)
+        # a few papers without metadata, as in the real corpus
+        shas = [make_sha(i) for i in range(n + n // 10)]
+
+        meta_ner_all = make_meta_ner(n)
+        start_t = time.perf_counter()
+        per_document(meta_ner_all, shas)
+        before_t = time.perf_counter() - start_t
+
+        start_t = time.perf_counter()
+        meta_store(metadata_path, ner_path, shas, os.path.join(work_dir, 'meta.db'))
+        after_t = time.perf_counter() - start_t
+        shutil.rmtree(work_dir)
+        print(f'{n}\t{before_t:0.3f}\t{after_t:0.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the per-sha entity/metadata join")
+    parser.add_argument('--sizes', help="Corpus sizes to time", type=int, nargs='+',
+                        default=[1000, 2000, 4000, 8000])
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,56 @@
+"""bench_neighbours.py
+Times the precomputed entity neighbour stage on synthetic papers, and checks its neighbours for a
+sample of papers against a brute-force cosine similarity over the full TF-IDF matrix.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, random, time
+import numpy as np
+from cord_19_ems.es_module.neighbours import tfidf_matrix, top_k_similar
+from synthetic import make_meta_ner
+
+
+def entity_lists(meta_ner_all):
+    """ Each paper's entities, as they are tokenized in the 'ents' field. """
+    return [[ent.replace(' ', '_') for entlist in info['entities'].values() for ent in entlist]
+            for info in meta_ner_all.values()]
+
+
+def brute_force_row(indptr, indices, data, row, n_cols):
+    """ Cosine similarity of 'row' with every row, one full dot product each. """
+    vector = np.zeros(n_cols)
+    vector[indices[indptr[row]:indptr[row + 1]]] = data[indptr[row]:indptr[row + 1]]
+    row_of = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    similarity = np.bincount(row_of, weights=data * vector[indices], minlength=len(indptr) - 1)
+    similarity[row] = 0
+    return similarity
+
+
+def main():
+    docs = entity_lists(make_meta_ner(args.papers, args.ents_per_paper, args.vocab_size))
+    start_t = time.perf_counter()
+    matrix = tfidf_matrix(docs, args.max_df)
+    neighbours, scores = top_k_similar(*matrix, k=args.k)
+    elapsed_t = time.perf_counter() - start_t
+    print(f'{args.papers} papers, {len(matrix[1])} entity weights: {elapsed_t:0.2f} seconds '
+          f'({args.papers / elapsed_t:0.0f} papers/sec)')
+
+    # equivalence: the top k scores of sampled rows match those of the brute-force similarity
+    n_cols = matrix[1].max() + 1
+    for row in random.Random(0).sample(range(args.papers), args.check_rows):
+        expected = np.sort(brute_force_row(*matrix, row, n_cols))[::-1][:args.k]
+        found = neighbours[row] >= 0
+        assert np.allclose(scores[row][found], expected[expected > 0], atol=1e-5)
+    print(f'top {args.k} neighbours of {args.check_rows} sampled papers match brute force')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the precomputed entity neighbour stage")
+    parser.add_argument('--papers', help="Number of synthetic papers", type=int, default=20000)
+    parser.add_argument('--ents_per_paper', help="Entities per synthetic paper", type=int, default=40)
+    parser.add_argument('--vocab_size', help="Number of distinct synthetic entities", type=int, default=5000)
+    parser.add_argument('--k', help="Neighbours kept per paper", type=int, default=100)
+    parser.add_argument('--max_df', help="Largest fraction of papers an entity may occur in", type=float, default=0.2)
+    parser.add_argument('--check_rows', help="Number of papers checked against brute force", type=int, default=5)
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,58 @@
+"""bench_pagerank.py
+Compares the CSR CitationGraph pagerank against networkx, for speed and peak memory, on a
+corpus written by index.py or on a synthetic graph, and checks that the scores agree.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, time, tracemalloc
+import networkx as nx
+from cord_19_ems.citation_graph.graph import CitationGraph
+from cord_19_ems.es_module.corpus import Corpus
+from synthetic import make_citation_edges
+
+
+def measure(func, *args):
+    """ Returns (result, seconds, peak MB of python allocations) for func(*args). """
+    tracemalloc.start()
+    start_t = time.perf_counter()
+    result = func(*args)
+    elapsed_t = time.perf_counter() - start_t
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed_t, peak
+
+
+def networkx_pagerank(edges):
+    return nx.pagerank(nx.DiGraph(edges))
+
+
+def csr_pagerank(edges):
+    return CitationGraph.from_edges(edges).pagerank()
+
+
+def main():
+    if args.corpus_dir:
+        edges = list(Corpus(args.corpus_dir).citation_edges())
+    else:
+        edges = make_citation_edges(args.papers, args.refs_per_paper)
+    print(f'{len(edges)} citation edges')
+
+    nx_scores, nx_time, nx_peak = measure(networkx_pagerank, edges)
+    csr_scores, csr_time, csr_peak = measure(csr_pagerank, edges)
+    print(f'networkx:      {nx_time:0.2f} seconds, {nx_peak:0.1f} MB peak')
+    print(f'CitationGraph: {csr_time:0.2f} seconds, {csr_peak:0.1f} MB peak')
+
+    # equivalence: same nodes, and scores within the convergence tolerance of each other
+    assert nx_scores.keys() == csr_scores.keys()
+    max_diff = max(abs(nx_scores[title] - csr_scores[title]) for title in nx_scores)
+    print(f'max absolute difference in scores: {max_diff:0.2e}')
+    assert max_diff < 1e-6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark citation graph pagerank against networkx")
+    parser.add_argument('--corpus_dir', help="Corpus directory written by index.py (default: synthetic graph)")
+    parser.add_argument('--papers', help="Number of papers in the synthetic graph", type=int, default=20000)
+    parser.add_argument('--refs_per_paper', help="References per paper in the synthetic graph", type=int, default=30)
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,51 @@
+"""bench_source_filtering.py
+Measures response size and latency of result pages with and without the per-view _source
+projections in query.py, against a running Elasticsearch with a built index.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, json, os, sys, time
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl import Search
+import cord_19_ems
+
+# query.py is run as a script from its own directory, and imports its neighbours that way
+sys.path.insert(0, os.path.join(os.path.dirname(cord_19_ems.__file__), 'es_module'))
+from query import build_search, SOURCE_FIELDS
+
+QUERIES = ['coronavirus origin', 'spike protein', 'bat reservoir', 'genome sequencing', 'zoonotic transmission',
+           'viral evolution', 'receptor binding domain', 'pangolin', 'phylogenetic analysis', 'mutation rate']
+
+
+def run(es, body):
+    """ Returns (response bytes, seconds) for one search request. """
+    start_t = time.perf_counter()
+    response = es.search(index=args.index_name, body=body)
+    elapsed_t = time.perf_counter() - start_t
+    return len(json.dumps(response).encode('utf-8')), elapsed_t
+
+
+def main():
+    es = Elasticsearch()
+    totals = {'full': [0, 0.0], 'serp': [0, 0.0]}
+    for text in QUERIES:
+        s = build_search(Search(), text, '', 0, 99999, 'true', 'or')[:args.page_size]
+        for view, search in (('full', s), ('serp', s.source(includes=SOURCE_FIELDS['serp']))):
+            for _ in range(args.repeat):
+                size, elapsed_t = run(es, search.to_dict())
+                totals[view][0] += size
+                totals[view][1] += elapsed_t
+
+    n = len(QUERIES) * args.repeat
+    for view, (size, elapsed_t) in totals.items():
+        print(f'{view}:\t{size / n / 1024:0.1f} KB per page\t{elapsed_t / n * 1000:0.1f} ms per page')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark _source filtering of result pages")
+    parser.add_argument('--index_name', help="Name of the index (alias) created by index.py",
+                        default="another_covid_index")
+    parser.add_argument('--page_size', help="Hits per page", type=int, default=10)
+    parser.add_argument('--repeat', help="Times each query is run", type=int, default=5)
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,81 @@
+"""load_test.py
+Serves query.py with gunicorn at increasing numbers of worker processes and measures request
+throughput and latency of a fixed mix of result-page urls at each one.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, os, subprocess, sys, time, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import cord_19_ems
+
+ES_MODULE_DIR = os.path.join(os.path.dirname(cord_19_ems.__file__), 'es_module')
+
+QUERIES = ['coronavirus origin', 'spike protein', 'bat reservoir', 'genome sequencing', 'zoonotic transmission']
+
+
+def result_urls(base_url):
+    """ First three result pages of each query, with the query carried in the url. """
+    urls = []
+    for text in QUERIES:
+        params = urlencode({'type': 'search', 'query': text, 'authors': '', 'in_english': 'true',
+                            'search_operator': 'or', 'mindate': '', 'maxdate': '', 'ent': ''})
+        urls.extend('%s/results/%d?%s' % (base_url, page, params) for page in (1, 2, 3))
+    return urls
+
+
+def fetch(url):
+    start_t = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - start_t
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start: ' + url)
+
+
+def run_load(urls, concurrency, n_requests):
+    """ Returns (requests/sec, p50 seconds, p99 seconds) for n_requests spread over the urls. """
+    start_t = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = sorted(pool.map(fetch, (urls[i % len(urls)] for i in range(n_requests))))
+    elapsed_t = time.perf_counter() - start_t
+    return n_requests / elapsed_t, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    base_url = 'http://127.0.0.1:%d' % args.port
+    env = dict(os.environ, CORD19_INDEX_NAME=args.index_name)
+    print('workers\treq/sec\tp50 ms\tp99 ms')
+    for workers in args.workers:
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', base_url[7:],
+                                   'query:app'], cwd=ES_MODULE_DIR, env=env)
+        try:
+            wait_until_up(base_url + '/')
+            urls = result_urls(base_url)
+            throughput, p50, p99 = run_load(urls, args.concurrency, args.requests)
+            print(f'{workers}\t{throughput:0.1f}\t{p50 * 1000:0.1f}\t{p99 * 1000:0.1f}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test query.py under gunicorn with different numbers of workers")
+    parser.add_argument('--index_name', help="Name of the index (alias) created by index.py",
+                        default="another_covid_index")
+    parser.add_argument('--workers', help="Numbers of gunicorn workers to test", type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--concurrency', help="Number of concurrent clients", type=int, default=16)
+    parser.add_argument('--requests', help="Number of requests per run", type=int, default=500)
+    parser.add_argument('--port', help="Port to serve on", type=int, default=8765)
+    args = parser.parse_args()
+    main()
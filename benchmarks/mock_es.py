@@ -0,0 +1,158 @@
+"""mock_es.py
+An in-process stand-in for a single-node Elasticsearch, for running the benchmarks without a
+cluster or network access. It plugs into the elasticsearch client as its connection class, so
+requests still go through the client's serialization and transport; bulk requests store the
+documents in memory, searches (also in msearch batches) return them in id order, ignoring the
+query except for an ids filter and the inner hits of nested clauses, with _source filtering and
+the requested page, also from a point in time with
+search_after (where a document's sort key is its id, and the point in time is the live index),
+and gets and mgets return stored documents. The _meta of each index's mapping is kept too.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import json
+from elasticsearch import Elasticsearch
+from elasticsearch.connection import Connection
+
+# documents stored by bulk requests, per index
+DOCUMENTS = {}
+# the _meta of each index's mapping, from index creation and put mapping requests
+META = {}
+
+
+def filter_source(source, includes=None, excludes=None):
+    """ Top-level _source filtering: 'citations.title' keeps (all of) 'citations'. """
+    if includes:
+        fields = {field.split('.')[0] for field in includes}
+        source = {k: v for k, v in source.items() if k in fields}
+    if excludes:
+        source = {k: v for k, v in source.items() if k not in excludes}
+    return source
+
+
+class MockConnection(Connection):
+    """ Answers the requests made by index.py's stages and by query.py, from DOCUMENTS. """
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        path = url.split('?')[0].strip('/').split('/')
+        params = {k: v.decode('utf-8') if isinstance(v, bytes) else v for k, v in (params or {}).items()}
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+
+        if path == ['']:
+            status, data = 200, {"version": {"number": "7.5.0", "build_flavor": "default"},
+                                 "tagline": "You Know, for Search"}
+        elif path[-1] == '_bulk':
+            status, data = 200, self.bulk(body, path[0] if len(path) > 1 else None)
+        elif path[-1] == '_pit':
+            status, data = 200, {"id": path[0]} if method == 'POST' else {"succeeded": True, "num_freed": 1}
+        elif path[-1] == '_msearch':
+            lines = [json.loads(line) for line in body.split('\n') if line]
+            status, data = 200, {"responses": [self.search(header.get('index', path[0]), search, {})
+                                               for header, search in zip(lines[::2], lines[1::2])]}
+        elif path[-1] == '_mget':
+            includes = params.get('_source_includes', '').split(',') if params.get('_source_includes') else None
+            docs = []
+            for doc_id in json.loads(body)['ids']:
+                document = DOCUMENTS.get(path[0], {}).get(str(doc_id))
+                docs.append({"_index": path[0], "_id": str(doc_id), "found": False} if document is None else
+                            {"_index": path[0], "_id": str(doc_id), "found": True,
+                             "_source": filter_source(document, includes)})
+            status, data = 200, {"docs": docs}
+        elif path[-1] == '_search':
+            status, data = 200, self.search(path[0], json.loads(body) if body else {}, params)
+        elif len(path) == 3 and path[1] in ('_doc', '_source'):
+            document = DOCUMENTS.get(path[0], {}).get(path[2])
+            if document is None:
+                status, data = 404, {"_index": path[0], "_id": path[2], "found": False}
+            else:
+                source = filter_source(document, params.get('_source_includes', '').split(',') if
+                                       params.get('_source_includes') else None,
+                                       params.get('_source_excludes', '').split(',') if
+                                       params.get('_source_excludes') else None)
+                status, data = 200, {"_index": path[0], "_type": "_doc", "_id": path[2], "_version": 1,
+                                     "found": True, "_source": source}
+        elif path[-1] == '_mapping':
+            if method == 'PUT':
+                META[path[0]] = json.loads(body).get('_meta', {})
+                status, data = 200, {"acknowledged": True}
+            else:
+                status, data = 200, {name: {"mappings": {"_meta": META.get(name, {})}} for name in DOCUMENTS}
+        elif len(path) == 1 and method == 'PUT' and body:
+            META[path[0]] = json.loads(body).get('mappings', {}).get('_meta', {})
+            status, data = 200, {"acknowledged": True}
+        elif path[-1] == '_alias' or path[0] == '_alias':
+            status, data = 200, {name: {"aliases": {}} for name in DOCUMENTS}
+        else:
+            status, data = 200, {"acknowledged": True}
+
+        if status >= 300 and status not in ignore:
+            self._raise_error(status, json.dumps(data))
+        return status, {'x-elastic-product': 'Elasticsearch'}, json.dumps(data)
+
+    @staticmethod
+    def bulk(body, default_index):
+        items = []
+        lines = iter(line for line in body.split('\n') if line)
+        for line in lines:
+            (op, meta), = json.loads(line).items()
+            index = DOCUMENTS.setdefault(meta.get('_index', default_index), {})
+            doc_id = str(meta.get('_id'))
+            if op == 'delete':
+                index.pop(doc_id, None)
+            elif op == 'update':
+                index.setdefault(doc_id, {}).update(json.loads(next(lines)).get('doc', {}))
+            else:
+                index[doc_id] = json.loads(next(lines))
+            items.append({op: {"_index": meta.get('_index', default_index), "_id": doc_id, "status": 201}})
+        return {"took": 1, "errors": False, "items": items}
+
+    @staticmethod
+    def search(index, body, params):
+        if 'pit' in body:
+            index = body['pit']['id']
+        documents = DOCUMENTS.get(index, {})
+        start, size = body.get('from', 0), body.get('size', 10)
+        source = body.get('_source', {})
+        includes = source.get('includes') if isinstance(source, dict) else None
+        doc_ids = sorted(documents, key=int)
+        bool_query = body.get('query', {}).get('bool', {})
+        for clause in bool_query.get('filter', []):
+            if 'ids' in clause:
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id in clause['ids']['values']]
+        # a descending tiebreaker is a search for the page before search_after
+        tiebreaker = body['sort'][-1] if 'sort' in body else {}
+        reverse = isinstance(tiebreaker, dict) and tiebreaker.get('_shard_doc', {}).get('order') == 'desc'
+        if reverse:
+            doc_ids.reverse()
+        if 'search_after' in body:
+            after = body['search_after'][-1]
+            doc_ids = [doc_id for doc_id in doc_ids if (int(doc_id) < after if reverse else int(doc_id) > after)]
+        hits = [{"_index": index, "_type": "_doc", "_id": doc_id, "_score": 1.0,
+                 "_source": filter_source(documents[doc_id], includes)}
+                for doc_id in doc_ids[start:start + size]]
+        for clause in bool_query.get('should', []):
+            if 'inner_hits' in clause.get('nested', {}):
+                path, inner = clause['nested']['path'], clause['nested']['inner_hits']
+                for hit in hits:
+                    items = documents[hit['_id']].get(path, [])
+                    start = inner.get('from', 0)
+                    hit['inner_hits'] = {path: {"hits": {
+                        "total": {"value": len(items), "relation": "eq"},
+                        "hits": [{"_nested": {"field": path, "offset": n},
+                                  "_source": filter_source(items[n], [name.split('.', 1)[1] for name in
+                                                                      inner.get('_source', [])] or None)}
+                                 for n in range(start, min(start + inner.get('size', 3), len(items)))]}}}
+        if 'sort' in body:
+            for hit in hits:
+                hit['sort'] = [1.0] * (len(body['sort']) - 1) + [int(hit['_id'])]
+        data = {"took": 1, "timed_out": False, "hits": {"total": {"value": len(documents), "relation": "eq"},
+                                                        "max_score": 1.0, "hits": hits}}
+        if 'pit' in body:
+            data['pit_id'] = body['pit']['id']
+        return data
+
+
+def mock_client(**kwargs):
+    """ An Elasticsearch client whose requests are answered by MockConnection. """
+    return Elasticsearch(hosts=['mock'], connection_class=MockConnection, **kwargs)
@@ -0,0 +1,222 @@
+"""run_suite.py
+Builds an index from a synthetic CORD-19 release, one pipeline stage at a time (cross-reference,
+corpus scan, citation graph, pagerank, anchor text, language, document build, bulk load and
+entity neighbours), then replays a mix of queries against the Flask app of query.py and reports
+throughput and p50/p99 latency per query type, and the same kinds of queries through the msearch
+batches of batch_query.py. Runs against a local single-node Elasticsearch
+(--es_url) or, by default, the in-process stand-in of mock_es.py, which needs no network.
+Stage timings come from the build metrics of index.py and are written to a JSON report.
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import argparse, os, shutil, sys, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl.connections import connections
+from load_test import ES_MODULE_DIR, QUERIES, result_urls
+from mock_es import mock_client, DOCUMENTS
+from synthetic import write_dataset
+
+# query.py is run as a script from its own directory, and imports its neighbours that way
+sys.path.insert(0, ES_MODULE_DIR)
+import index, query, batch_query
+from cord_19_ems.es_module.corpus import write_corpus
+from cord_19_ems.es_module.metadata import build_meta_store
+from cord_19_ems.es_module.extras import generate_citation_graph
+from cord_19_ems.es_module.metrics import build_metrics, instrument_transport
+
+# stages of the build, by the names they are recorded under, in pipeline order
+STAGES = ['build_meta_store', 'write_corpus', 'generate_citation_graph', 'pagerank', 'build_anchor_store',
+          'detect_languages', 'document_build', 'bulk_load', 'build_neighbours']
+
+
+def build(work_dir, client):
+    """ Runs each stage of index.py's full build on the synthetic release in 'work_dir'. Returns the documents. """
+    data_dir, metadata_path, ner_path = write_dataset(work_dir, args.papers, args.paragraphs, args.refs_per_paper,
+                                                      args.in_corpus_fraction, seed=args.seed)
+    index.es = client
+    index.args = index.build_parser().parse_args([
+        '--index_name', args.index_name, '--module_dir_path', work_dir, '--data_dir_path', data_dir,
+        '--metadata_path', metadata_path, '--ner_path', ner_path, '--meta_ner_path', os.path.join(work_dir, 'meta.db'),
+        '--workers', str(args.workers), '--bulk_threads', str(args.bulk_threads), '--chunk_size', str(args.chunk_size),
+        '--mapping', args.mapping, '--highlighting', args.highlighting])
+    build_metrics.reset()
+
+    build_meta_store(metadata_path, ner_path, index.entity_types, index.args.meta_ner_path)
+    corpus = write_corpus(data_dir, os.path.join(work_dir, 'corpus'), prefix_chars=index.args.langid_chars)
+    generate_citation_graph(corpus, work_dir)
+    doc_ids = list(range(len(corpus)))
+    context = index.load_context(corpus, doc_ids, args.index_name)
+
+    # documents are built up front, so that building and sending them are timed separately
+    with build_metrics.stage('document_build'):
+        actions = list(index.generate_actions(enumerate(corpus), context, args.workers, args.chunk_size))
+    if args.es_url:
+        index.create_index(args.index_name, args.mapping, args.highlighting)
+    index.bulk_load(iter(actions), args.bulk_threads, args.chunk_size)
+    client.indices.refresh(index=args.index_name)
+    index.build_neighbours(corpus, doc_ids, context['meta'], args.index_name)
+    return actions
+
+
+def index_stats(client):
+    """ Size on disk and number of Lucene documents (including hidden nested ones) of the merged benchmark index. """
+    client.indices.forcemerge(index=args.index_name, max_num_segments=1, request_timeout=3600)
+    stats = client.indices.stats(index=args.index_name)['_all']['primaries']
+    return {"store_bytes": stats['store']['size_in_bytes'], "lucene_docs": stats['docs']['count']}
+
+
+def query_mix(documents):
+    """ (query type, path) pairs: result pages of text searches, 'more like this' pages and their export,
+    document pages and the first page of each part the document pages load. """
+    mix = [('search', url) for url in result_urls('')]
+    for document in documents[:args.reference_docs]:
+        doc_id = str(document['_id'])
+        mix.append(('more_like_this_citations', '/results/1?' + urlencode({'type': 'more_like_this_citations',
+                                                                           'query': doc_id})))
+        mix.append(('more_like_this_entities', '/results/1?' + urlencode({'type': 'more_like_this_entities',
+                                                                          'query': doc_id})))
+        if document['ents']:
+            mix.append(('match_entity', '/results/1?' + urlencode({'type': 'match_entity', 'query': doc_id,
+                                                                   'ent': document['ents'].split()[0]})))
+        mix.append(('export_more_like_this_citations', '/export?' + urlencode({'type': 'more_like_this_citations',
+                                                                               'query': doc_id})))
+        mix.append(('document', '/documents/' + doc_id))
+        for part in query.DOCUMENT_PARTS:
+            mix.append(('document_' + part, '/documents/%s/%s?page=1' % (doc_id, part)))
+    return mix
+
+
+def replay(mix, concurrency, n_requests):
+    """ Sends n_requests of the mix to the Flask app from 'concurrency' threads. Returns the latencies per query type. """
+    local = threading.local()
+
+    def fetch(item):
+        kind, path = item
+        if not hasattr(local, 'client'):
+            local.client = query.app.test_client()
+        start_t = time.perf_counter()
+        response = local.client.get(path)
+        elapsed_t = time.perf_counter() - start_t
+        if response.status_code != 200:
+            raise RuntimeError('%s returned %d' % (path, response.status_code))
+        return kind, elapsed_t
+
+    latencies = defaultdict(list)
+    start_t = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for kind, elapsed_t in pool.map(fetch, (mix[i % len(mix)] for i in range(n_requests))):
+            latencies[kind].append(elapsed_t)
+            latencies['all'].append(elapsed_t)
+    return latencies, time.perf_counter() - start_t
+
+
+def batch(documents, client):
+    """ Runs --batch_queries text searches and 'more like this' searches through batch_query.py. Returns its
+    throughput and the p50/p99 latency of the msearch request each query was in. """
+    states = [query.query_state({'query': text}) for text in QUERIES]
+    for document in documents[:args.reference_docs]:
+        for search_type in ('more_like_this_citations', 'more_like_this_entities'):
+            states.append(query.query_state({'type': search_type, 'query': str(document['_id'])}))
+    states = [states[i % len(states)] for i in range(args.batch_queries)]
+    start_t = time.perf_counter()
+    latencies = sorted(elapsed_t for _, _, elapsed_t in
+                       batch_query.run_queries(states, client, args.batch_size, args.concurrency))
+    elapsed_t = time.perf_counter() - start_t
+    return {"queries": len(states), "queries_per_sec": len(states) / elapsed_t,
+            "p50_ms": latencies[len(latencies) // 2] * 1000, "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+def summarize(latencies, elapsed_t):
+    summary = {}
+    for kind, values in latencies.items():
+        values = sorted(values)
+        summary[kind] = {"requests": len(values),
+                         "p50_ms": values[len(values) // 2] * 1000,
+                         "p99_ms": values[int(len(values) * 0.99)] * 1000}
+    summary['all']['req_per_sec'] = len(latencies['all']) / elapsed_t
+    return summary
+
+
+def main():
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='cord19_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    client = Elasticsearch([args.es_url], timeout=100) if args.es_url else mock_client()
+    connections.add_connection('default', client)  # used by query.py's searches
+    instrument_transport(client)
+    DOCUMENTS.clear()
+    try:
+        documents = build(work_dir, client)
+
+        query.index_name = args.index_name
+        query.graph_dir_path = os.path.join(work_dir, 'graph')
+        query.neighbours_dir_path = os.path.join(work_dir, 'neighbours')
+        query.cache_backend = args.cache
+        query.highlighter = args.highlighter
+        mix = query_mix(documents)
+        replay(mix, 1, len(mix))  # warm up: compile templates and load the graph and neighbours
+        latencies, elapsed_t = replay(mix, args.concurrency, args.requests)
+        queries = summarize(latencies, elapsed_t)
+        batch_queries = batch(documents, client)
+
+        stats = index_stats(client) if args.es_url else {}
+        report = build_metrics.report()
+        print(f'{args.papers} papers, {"Elasticsearch at " + args.es_url if args.es_url else "mock transport"}')
+        print('stage\tseconds')
+        for stage in STAGES:
+            print(f'{stage}\t{report["stages"].get(stage, {}).get("seconds", 0.0):0.2f}')
+        print(f'bulk: {report["docs_per_sec"]:0.1f} docs/sec, {report["counters"].get("bulk.bytes_sent", 0) / 2 ** 20:0.1f} MB sent')
+        print('query type\trequests\tp50 ms\tp99 ms')
+        for kind, latency in sorted(queries.items()):
+            print(f'{kind}\t{latency["requests"]}\t{latency["p50_ms"]:0.1f}\t{latency["p99_ms"]:0.1f}')
+        print(f'{queries["all"]["req_per_sec"]:0.1f} req/sec')
+        print(f'batch: {batch_queries["queries_per_sec"]:0.1f} queries/sec, p50 {batch_queries["p50_ms"]:0.1f} ms, '
+              f'p99 {batch_queries["p99_ms"]:0.1f} ms')
+        if stats:
+            print(f'index: {stats["store_bytes"] / 2 ** 20:0.1f} MB, {stats["lucene_docs"]} lucene documents')
+
+        path = build_metrics.write_report(args.report_dir, benchmark='run_suite', settings=vars(args), queries=queries,
+                                          batch=batch_queries, index=stats)
+        print('report written to', path)
+    finally:
+        if args.es_url and not args.keep:
+            client.indices.delete(index=args.index_name, ignore=[404])
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every index.py stage and query.py on a synthetic release")
+    parser.add_argument('--es_url', help="Local single-node Elasticsearch to run against (default: mocked transport)")
+    parser.add_argument('--index_name', help="Index created for the benchmark", default="cord19_benchmark")
+    parser.add_argument('--papers', help="Number of synthetic papers", type=int, default=2000)
+    parser.add_argument('--paragraphs', help="Body paragraphs per paper", type=int, default=10)
+    parser.add_argument('--refs_per_paper', help="References per paper", type=int, default=30)
+    parser.add_argument('--in_corpus_fraction', help="Fraction of references citing other synthetic papers",
+                        type=float, default=0.5)
+    parser.add_argument('--seed', help="Random seed of the synthetic release", type=int, default=0)
+    parser.add_argument('--mapping', help="Mapping profile of the benchmark index", choices=['full', 'lean'],
+                        default='full')
+    parser.add_argument('--highlighting', help="Highlighting support indexed for titles and abstracts",
+                        choices=['none', 'offsets', 'term_vectors'], default='offsets')
+    parser.add_argument('--highlighter', help="Highlighter of result pages", choices=['unified', 'fvh', 'plain'],
+                        default='unified')
+    parser.add_argument('--workers', help="Worker processes building documents", type=int, default=1)
+    parser.add_argument('--bulk_threads', help="Threads sending bulk requests", type=int, default=1)
+    parser.add_argument('--chunk_size', help="Documents per worker task and per bulk request", type=int, default=500)
+    parser.add_argument('--reference_docs', help="Number of documents used for 'more like this' and document pages",
+                        type=int, default=20)
+    parser.add_argument('--concurrency', help="Number of concurrent clients replaying queries", type=int, default=8)
+    parser.add_argument('--requests', help="Number of queries replayed", type=int, default=1000)
+    parser.add_argument('--batch_queries', help="Number of queries run through batch_query.py", type=int,
+                        default=1000)
+    parser.add_argument('--batch_size', help="Queries per msearch request of batch_query.py", type=int, default=50)
+    parser.add_argument('--cache', help="Result page cache of the app", choices=['memory', 'sqlite', 'none'],
+                        default='none')
+    parser.add_argument('--work_dir', help="Directory for the synthetic release and build files (default: temporary)")
+    parser.add_argument('--report_dir', help="Directory the JSON report is written to", default='reports')
+    parser.add_argument('--keep', help="Keep the benchmark index and work directory", action='store_true')
+    args = parser.parse_args()
+    main()
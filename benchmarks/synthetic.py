@@ -0,0 +1,142 @@
+"""synthetic.py
+Generates synthetic, CORD-19-shaped data for the benchmarks in this directory: entity and
+metadata records, citation edges, and whole releases (paper json files, metadata csv and NER file).
+project: CORD-19 COSI134A FINAL PROJECT
+"""
+
+import csv, json, os, random
+
+ENTITY_TYPES = ['GPE', 'GENE_OR_GENOME', 'VIRUS', 'DISEASE_OR_SYNDROME', 'ORGANISM', 'CHEMICAL', 'DATE']
+
+
+def make_sha(i):
+    return '%040x' % i
+
+
+def make_meta_ner(n_papers, ents_per_paper=40, vocab_size=5000, seed=0):
+    """ Returns a dict shaped like cross_ref_data_all_sources.json for 'n_papers' papers. """
+    rng = random.Random(seed)
+    vocab = ['entity %d' % i for i in range(vocab_size)]
+    meta_ner_all = {}
+    for i in range(n_papers):
+        entities = {}
+        for _ in range(ents_per_paper):
+            entities.setdefault(rng.choice(ENTITY_TYPES), []).append(rng.choice(vocab))
+        meta_ner_all[make_sha(i)] = {"entities": entities,
+                                     "source": "PMC",
+                                     "doi": "10.0/%d" % i,
+                                     "publish_time": "%d-01-01" % rng.randint(2002, 2020),
+                                     "journal": "Journal %d" % rng.randint(0, 50),
+                                     "has_full_text": "True"}
+    return meta_ner_all
+
+
+def make_citation_edges(n_papers, refs_per_paper=30, seed=0):
+    """
+    Returns (citing title, cited title) pairs. About half of all references point at papers in
+    the corpus, skewed towards a small set of highly cited ones; the rest are outside titles.
+    """
+    rng = random.Random(seed)
+    edges = []
+    for i in range(n_papers):
+        for _ in range(refs_per_paper):
+            if rng.random() < 0.5:
+                cited = 'paper %d' % int(n_papers * rng.random() ** 3)
+            else:
+                cited = 'outside %d' % rng.randrange(n_papers * 10)
+            edges.append(('paper %d' % i, cited))
+    return edges
+
+
+WORDS = ['virus', 'cell', 'protein', 'infection', 'patients', 'receptor', 'binding', 'sequence', 'host',
+         'transmission', 'respiratory', 'samples', 'analysis', 'expression', 'antibody', 'strain', 'clinical',
+         'the', 'of', 'and', 'in', 'was', 'with', 'were', 'for', 'by', 'that', 'these', 'results']
+
+METADATA_COLUMNS = ['sha', 'source_x', 'title', 'doi', 'pmcid', 'pubmed_id', 'license', 'abstract',
+                    'publish_time', 'authors', 'journal', 'has_full_text']
+
+
+def make_sentence(rng, n_words):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_paper(i, n_papers, rng, paragraphs=10, refs_per_paper=30, in_corpus_fraction=0.5):
+    """
+    A paper in the CORD-19 json format, with 'paragraphs' body paragraphs of a few sentences and
+    'refs_per_paper' bibliography entries, each cited from a random sentence. A fraction of the
+    references are other synthetic papers, skewed towards a few highly cited ones.
+    """
+    bib_entries = {}
+    for r in range(refs_per_paper):
+        if rng.random() < in_corpus_fraction:
+            title = 'Paper %d %s' % (int(n_papers * rng.random() ** 3), WORDS[0])
+        else:
+            title = 'Outside paper %d' % rng.randrange(n_papers * 10)
+        bib_entries['BIBREF%d' % r] = {"ref_id": 'b%d' % r, "title": title, "year": rng.randint(1990, 2020),
+                                       "authors": [{"first": "A", "middle": [], "last": "Author%d" % rng.randrange(1000),
+                                                    "suffix": ""}], "venue": "", "volume": "", "issn": "",
+                                       "pages": "", "other_ids": {}}
+    refs = list(bib_entries)
+
+    body_text = []
+    for p in range(paragraphs):
+        text, cite_spans = '', []
+        for _ in range(rng.randint(3, 8)):
+            if text:
+                text += ' '
+            sentence = make_sentence(rng, rng.randint(8, 30))
+            if refs and rng.random() < 0.4:
+                # cite a reference at the end of the sentence, before the full stop
+                ref = rng.choice(refs)
+                marker = '[%d]' % (refs.index(ref) + 1)
+                start = len(text) + len(sentence)
+                cite_spans.append({"start": start, "end": start + len(marker), "text": marker, "ref_id": ref})
+                sentence = sentence[:-1] + ' ' + marker + '.'
+            text += sentence
+        body_text.append({"text": text, "cite_spans": cite_spans, "ref_spans": [], "section": "Section %d" % (p // 3)})
+
+    return {"paper_id": make_sha(i),
+            "metadata": {"title": 'Paper %d %s' % (i, WORDS[0]),
+                         "authors": [{"first": "First%d" % rng.randrange(100), "middle": [],
+                                      "last": "Last%d" % rng.randrange(1000), "suffix": "", "affiliation": {},
+                                      "email": ""} for _ in range(rng.randint(1, 6))]},
+            "abstract": [{"text": ' '.join(make_sentence(rng, rng.randint(8, 30)) for _ in range(4)),
+                          "cite_spans": [], "ref_spans": [], "section": "Abstract"}],
+            "body_text": body_text,
+            "bib_entries": bib_entries,
+            "ref_entries": {},
+            "back_matter": []}
+
+
+def write_dataset(out_dir, n_papers, paragraphs=10, refs_per_paper=30, in_corpus_fraction=0.5,
+                  ents_per_paper=40, vocab_size=5000, seed=0):
+    """
+    Writes a synthetic release under 'out_dir': the paper json files (data/), a metadata csv and a
+    CORD-NER json lines file, with the same layout as the files index.py reads. Returns their paths.
+    """
+    rng = random.Random(seed)
+    data_dir = os.path.join(out_dir, 'data', 'papers')
+    os.makedirs(data_dir, exist_ok=True)
+    for i in range(n_papers):
+        with open(os.path.join(data_dir, make_sha(i) + '.json'), 'w') as f:
+            json.dump(make_paper(i, n_papers, rng, paragraphs, refs_per_paper, in_corpus_fraction), f)
+
+    metadata_path = os.path.join(out_dir, 'metadata.csv')
+    with open(metadata_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(METADATA_COLUMNS)
+        for i in range(n_papers):
+            writer.writerow([make_sha(i), 'PMC', 'Paper %d' % i, '10.0/%d' % i, '', '', '', '',
+                             '%d-01-01' % rng.randint(2002, 2020), '', 'Journal %d' % rng.randint(0, 50), 'True'])
+
+    # one NER document per metadata row, in the same order
+    ner_path = os.path.join(out_dir, 'ner.json')
+    meta_ner = make_meta_ner(n_papers, ents_per_paper, vocab_size, seed)
+    with open(ner_path, 'w') as f:
+        for doc_id, info in enumerate(meta_ner.values()):
+            entities = [{"text": ent, "type": ent_type} for ent_type, entlist in info['entities'].items()
+                        for ent in entlist]
+            f.write(json.dumps({"doc_id": doc_id, "sents": [{"entities": entities}]}) + '\n')
+
+    return os.path.join(out_dir, 'data'), metadata_path, ner_path
@@ -0,0 +1,127 @@
+"""graph.py
+A compact citation graph: titles are interned to integer node ids and the edges are stored
+as CSR (compressed sparse row) arrays, so pagerank runs as vectorized numpy operations
+instead of over a networkx graph of title strings. Graphs are saved as a title table plus
+.npy edge arrays, which load memory-mapped.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import json, os
+import numpy as np
+
+
+class CitationGraph:
+    """
+    Directed citation graph over integer node ids. The out-edges of node i (the titles it
+    cites) are indices[indptr[i]:indptr[i + 1]], and its in-edges (the titles citing it) are
+    in_indices[in_indptr[i]:in_indptr[i + 1]]. 'titles' maps node id -> lowercased title
+    and 'ids' maps title -> node id.
+    """
+    def __init__(self, titles, indptr, indices, in_indptr=None, in_indices=None):
+        self.titles = titles
+        self.ids = {title: i for i, title in enumerate(titles)}
+        self.indptr = indptr
+        self.indices = indices
+        if in_indptr is None:
+            in_indptr, in_indices = self._transpose()
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+
+    def _transpose(self):
+        """ Builds the CSR arrays of in-edges from those of out-edges. """
+        src = np.repeat(np.arange(len(self.titles), dtype=np.int32), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        in_indptr = np.zeros(len(self.titles) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.titles)), out=in_indptr[1:])
+        return in_indptr, src[order]
+
+    def save(self, graph_dir):
+        """ Writes the title table and edge arrays to 'graph_dir'. """
+        os.makedirs(graph_dir, exist_ok=True)
+        with open(os.path.join(graph_dir, 'titles.json'), 'w') as f:
+            json.dump(self.titles, f)
+        for name in ('indptr', 'indices', 'in_indptr', 'in_indices'):
+            np.save(os.path.join(graph_dir, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, graph_dir, mmap=True):
+        """ Loads a graph written by save(). The edge arrays are memory-mapped unless mmap is False. """
+        with open(os.path.join(graph_dir, 'titles.json'), 'r') as f:
+            titles = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(graph_dir, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ('indptr', 'indices', 'in_indptr', 'in_indices')]
+        return cls(titles, *arrays)
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Builds the graph from (citing title, cited title) pairs. As with a networkx DiGraph,
+        only titles that appear in an edge become nodes, and repeated edges are kept once.
+        """
+        ids = {}
+        src, dst = [], []
+        for citing, cited in edges:
+            src.append(ids.setdefault(citing, len(ids)))
+            dst.append(ids.setdefault(cited, len(ids)))
+        n = len(ids)
+
+        # sort the edges by source and drop duplicates, by encoding each one as a single integer
+        keys = np.unique(np.array(src, dtype=np.int64) * n + np.array(dst, dtype=np.int64))
+        src, dst = keys // max(n, 1), keys % max(n, 1)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        titles = [None] * n
+        for title, i in ids.items():
+            titles[i] = title
+        return cls(titles, indptr, dst.astype(np.int32))
+
+    def __len__(self):
+        return len(self.titles)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def successors(self, title):
+        """ Titles cited by 'title' (empty if it is not in the graph). """
+        i = self.ids.get(title)
+        if i is None:
+            return []
+        return [self.titles[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def predecessors(self, title):
+        """ Titles citing 'title' (empty if it is not in the graph). """
+        i = self.ids.get(title)
+        if i is None:
+            return []
+        return [self.titles[j] for j in self.in_indices[self.in_indptr[i]:self.in_indptr[i + 1]]]
+
+    def pagerank(self, damping=0.85, tol=1e-6, max_iter=100):
+        """
+        Power-iteration pagerank, with the same conventions as networkx.pagerank: uniform
+        teleportation, dangling nodes spread their score uniformly, and iteration stops once
+        the L1 change between iterations is below len(graph) * tol (or after max_iter).
+        Returns a dict of title -> score.
+        """
+        n = len(self)
+        if n == 0:
+            return {}
+        out_degree = self.out_degree()
+        src = np.repeat(np.arange(n), out_degree)
+        weights = 1.0 / out_degree[src]
+        dangling = out_degree == 0
+
+        scores = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            previous = scores
+            scores = damping * np.bincount(self.indices, weights=previous[src] * weights, minlength=n)
+            scores += (damping * previous[dangling].sum() + 1.0 - damping) / n
+            if np.abs(scores - previous).sum() < n * tol:
+                break
+        return dict(zip(self.titles, scores.tolist()))
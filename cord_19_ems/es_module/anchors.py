@@ -0,0 +1,69 @@
+"""anchors.py
+This module collects anchor text, the sentences in which papers cite other papers of the corpus,
+as its own stage of the index pipeline. The spans recorded by the corpus scan are streamed into
+a sqlite store keyed by cited title, which the indexer reads lazily, one title per document,
+instead of holding every paper's citing sentences in memory and copying them to each worker.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import os, sqlite3
+from cord_19_ems.es_module.extras import timer
+
+
+@timer
+def build_anchor_store(corpus, titles_to_ids, out, doc_ids=None, batch_size=10000):
+    """
+    Writes the anchor spans of 'corpus' that cite a title in 'titles_to_ids' to the sqlite file
+    'out', as (cited title, citing document id, sentence) rows. 'doc_ids' maps corpus positions
+    to document ids, when they differ (incremental builds). The store is written to a temporary
+    file and moved into place once complete.
+    """
+    tmp = out + '.tmp'
+    if os.path.isfile(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.execute("CREATE TABLE anchors (title TEXT, doc_id INTEGER, text TEXT)")
+    batch = []
+    for i, name, surrounding_text in corpus.anchor_spans():
+        if name in titles_to_ids:
+            batch.append((name, doc_ids[i] if doc_ids else i, surrounding_text))
+        if len(batch) >= batch_size:
+            conn.executemany("INSERT INTO anchors VALUES (?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO anchors VALUES (?, ?, ?)", batch)
+    # index once all rows are in, which is much faster than maintaining it while inserting
+    conn.execute("CREATE INDEX anchors_title ON anchors (title)")
+    conn.commit()
+    conn.close()
+    os.replace(tmp, out)
+
+
+class AnchorStore:
+    """
+    Read access to the store written by build_anchor_store. get(title) returns the distinct
+    {"id", "text"} citations of a title, in corpus order. The sqlite connection is opened lazily
+    in each process, so an AnchorStore can be handed to worker processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def get(self, title):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path)
+            self._pid = os.getpid()
+        rows = self._conn.execute("SELECT doc_id, text FROM anchors WHERE title = ? ORDER BY rowid", (title,))
+        seen = set()
+        cited_by = []
+        for doc_id, text in rows:
+            # the same sentence is recorded once per citation span in it
+            if (doc_id, text) not in seen:
+                seen.add((doc_id, text))
+                cited_by.append({"id": doc_id, "text": text})
+        return cited_by
+
+    def __getstate__(self):
+        return {"path": self.path, "_conn": None, "_pid": None}
@@ -0,0 +1,227 @@
+"""async_query.py
+This module serves the query interface of query.py from asyncio, for an ASGI server such as
+hypercorn (`hypercorn -w 4 async_query:app`). It uses Quart, which mirrors the Flask API, and a
+pooled AsyncElasticsearch client, so Elasticsearch calls that do not depend on each other (e.g.
+the reference article and the 'more like this' search) run concurrently. The searches themselves
+are built by the same functions as in query.py.
+Requires `pip install quart hypercorn "elasticsearch[async]>=7.12"` and Elasticsearch 7.12 or later.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import asyncio, os, time, argparse
+from quart import Quart, render_template, request, jsonify, abort
+from elasticsearch import AsyncElasticsearch, NotFoundError, RequestError
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+import query
+from query import (query_state, serp_search, entity_search, citation_search, populate_results, set_citation_overlaps,
+                   part_page, part_search, inner_part_page, page_slice, page_cursors, pit_search, pit_response,
+                   decode_cursor, query_search, export_line, SOURCE_FIELDS, DOCUMENT_PARTS, PIT_KEEP_ALIVE,
+                   EXPORT_BATCH_SIZE, VERSION_CHECK_INTERVAL, parse_version, version_neighbours)
+
+app = Quart(__name__)
+es = None
+pool_size = int(os.environ.get('CORD19_ES_POOL', 25))  # connections to Elasticsearch, per worker process
+current_version = {"name": None, "mapping": 'full', "checked": 0.0}
+
+
+@app.before_serving
+async def connect():
+    global es
+    es = AsyncElasticsearch(hosts=['127.0.0.1'], maxsize=pool_size)
+
+
+@app.after_serving
+async def disconnect():
+    await es.close()
+
+
+async def open_pit():
+    raw = await es.open_point_in_time(index=query.index_name, keep_alive=PIT_KEEP_ALIVE)
+    return raw['id']
+
+
+async def paginate(s, page, cursor=''):
+    """ query.paginate: result page number 'page' of search s, a plain search without a cursor, otherwise in the
+    point in time of the cursor (or a new one), which is closed on the last page. """
+    cursor = decode_cursor(cursor)
+    if cursor is None:
+        s = page_slice(s, page)
+        response = Response(s, await es.search(index=query.index_name, body=s.to_dict()))
+        return response, page_cursors(response.hits.total, len(response.hits), page)
+
+    pit_id = cursor['pit']
+    try:
+        if pit_id is None:
+            pit_id = await open_pit()
+        raw = await es.search(body=pit_search(s, pit_id, page, cursor).to_dict())
+    except NotFoundError:
+        if cursor['pit'] is None:
+            raise
+        # the point in time expired: continue after the cursor's hits in a new one
+        raw = await es.search(body=pit_search(s, await open_pit(), page, cursor).to_dict())
+    response, cursors = pit_response(s, raw, page, cursor)
+    if not cursors['next']:
+        await es.close_point_in_time(body={'id': raw['pit_id']})
+    return response, cursors
+
+
+async def get_source(doc_id, **params):
+    raw = await es.get(index=query.index_name, id=doc_id, **params)
+    return raw['_source']
+
+
+async def index_version():
+    """ query.index_version, from the async client: the live index version, with its mapping profile in
+    current_version, re-checked every VERSION_CHECK_INTERVAL seconds. """
+    if time.time() - current_version['checked'] > VERSION_CHECK_INTERVAL:
+        version, mapping = parse_version(await es.indices.get_mapping(index=query.index_name))
+        current_version.update(name=version, mapping=mapping, checked=time.time())
+    return current_version['name']
+
+
+async def index_mapping():
+    """ query.index_mapping, from the async client. """
+    await index_version()
+    return current_version['mapping']
+
+
+async def get_entity_neighbours():
+    """ query.get_entity_neighbours; a new version's tables are loaded in a thread, off the event loop. """
+    return await asyncio.get_running_loop().run_in_executor(None, version_neighbours, await index_version())
+
+
+@app.route("/")
+async def search():
+    return await render_template('page_query.html')
+
+
+@app.route("/results", defaults={'page': 1}, methods=['GET', 'POST'])
+@app.route("/results/<int:page>", methods=['GET', 'POST'])
+async def results(page):
+    values = await request.values
+    state = query_state(values)
+    cursor = values.get('cursor', '')
+    s = Search(index=query.index_name)
+    doc_id = state['query']
+
+    # find me papers with similar citations; the search needs the reference article's citation keys
+    if state['type'] == 'more_like_this_citations':
+        article = await get_source(doc_id, _source_includes=SOURCE_FIELDS['reference'])
+        response, cursors = await paginate(citation_search(s, doc_id, article.get('citation_keys', [])), page, cursor)
+        results = populate_results(response)
+        set_citation_overlaps(results)
+        return await render_template('more_like_this.html', results=results, doc_id=doc_id, title=article['title'],
+                                     res_num=response.hits.total['value'], page_num=page, cursors=cursors,
+                                     state=state)
+
+    # find me papers with similar entities, or containing a specific entity;
+    # the reference article is only needed for its title, so fetch it alongside the search
+    if state['type'] in ('more_like_this_entities', 'match_entity'):
+        single_ent = state['type'] == 'match_entity'
+        neighbours = None if single_ent else await get_entity_neighbours()
+        s = entity_search(s, doc_id, single_ent=single_ent, ent=state['ent'], neighbours=neighbours)
+        article, (response, cursors) = await asyncio.gather(
+            get_source(doc_id, _source_includes=SOURCE_FIELDS['title']), paginate(s, page, cursor))
+        results = populate_results(response)
+        for i in results:
+            results[i]['overlap'] = ""
+        return await render_template('more_like_this.html', results=results, doc_id=doc_id, title=article['title'],
+                                     res_num=response.hits.total['value'], page_num=page, cursors=cursors,
+                                     state=state)
+
+    # standard search
+    mindate_query = int(state['mindate']) if len(state['mindate']) > 0 else 0
+    maxdate_query = int(state['maxdate']) if len(state['maxdate']) > 0 else 99999
+    shows = {'text': state['query'], 'authors': state['authors'], 'maxdate': state['maxdate'],
+             'mindate': state['mindate'], 'lang': state['in_english']}
+    s = serp_search(s, state['query'], state['authors'], mindate_query, maxdate_query, state['in_english'],
+                    state['search_operator'])
+    response, cursors = await paginate(s, page, cursor)
+    result_num = response.hits.total['value']
+    if result_num > 0:
+        results = populate_results(response)
+    else:
+        results = []
+        if len(state['query']) > 0:
+            results.append('No documents matching query: ' + state['query'])
+        if len(state['authors']) > 0:
+            results.append('Cannot find authors: ' + state['authors'])
+    return await render_template('page_SERP.html', results=results, res_num=result_num, page_num=page,
+                                 cursors=cursors, queries=shows, state=state)
+
+
+@app.route("/export", methods=['GET', 'POST'])
+async def export():
+    state = query_state(await request.values)
+    article = None
+    if state['type'] == 'more_like_this_citations':
+        article = await get_source(state['query'], _source_includes=SOURCE_FIELDS['reference'])
+    neighbours = await get_entity_neighbours() if state['type'] == 'more_like_this_entities' else None
+    s = query_search(state, article, neighbours).source(includes=SOURCE_FIELDS['export'])
+
+    async def lines():
+        pit_id = await open_pit()
+        cursor = None
+        try:
+            while True:
+                raw = await es.search(body=pit_search(s, pit_id, cursor=cursor, size=EXPORT_BATCH_SIZE).to_dict())
+                pit_id = raw.get('pit_id', pit_id)
+                hits = raw['hits']['hits']
+                for hit in hits:
+                    yield export_line(hit)
+                if len(hits) < EXPORT_BATCH_SIZE:
+                    break
+                cursor = {'pit': pit_id, 'after': hits[-1]['sort'], 'direction': 'next'}
+        finally:
+            await es.close_point_in_time(body={'id': pit_id})
+
+    return lines(), 200, {'Content-Type': 'application/x-ndjson'}
+
+
+# display a particular document given a result number
+@app.route("/documents/<res>", methods=['GET'])
+async def documents(res):
+    article = await get_source(res, _source_includes=SOURCE_FIELDS['document'])
+    return await render_template('page_targetArticle.html', article=article, title=article['title'], doc_id=res)
+
+
+@app.route("/documents/<res>/<part>", methods=['GET'])
+async def document_part(res, part):
+    if part not in DOCUMENT_PARTS:
+        abort(404)
+    page = request.args.get('page', 1, type=int)
+    if await index_mapping() == 'full':
+        try:
+            raw = await es.search(index=query.index_name, body=part_search(res, part, page).to_dict())
+        except RequestError:
+            # indices built before index.py raised max_inner_result_window only page the first 100 items
+            raw = None
+        if raw is not None:
+            if not raw['hits']['hits']:
+                abort(404)
+            return jsonify(inner_part_page(raw['hits']['hits'][0], part, page))
+    article = await get_source(res, _source_includes=DOCUMENT_PARTS[part][1])
+    return jsonify(part_page(article, part, page))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup and run the asyncio query page for CORD-19 database")
+    parser.add_argument('--index_name', help="Name of the index (alias) which you created when you ran index.py",
+                        default=query.index_name)
+    parser.add_argument('--neighbours_dir_path', help="Path to the entity neighbours directory written by index.py",
+                        default=query.neighbours_dir_path)
+    parser.add_argument('--pool_size', help="Number of pooled connections to Elasticsearch", type=int,
+                        default=pool_size)
+    parser.add_argument('--highlighter', help="Highlighter of result pages ('fvh' needs an index built with "
+                        "--highlighting term_vectors)", choices=['unified', 'fvh', 'plain'], default=query.highlighter)
+    parser.add_argument('--highlight_fragment_size', help="Characters of the abstract shown highlighted on result "
+                        "pages (0: the whole abstract)", type=int, default=query.highlight_fragment_size)
+    args = parser.parse_args()
+    query.index_name = args.index_name
+    query.neighbours_dir_path = args.neighbours_dir_path
+    query.highlighter, query.highlight_fragment_size = args.highlighter, args.highlight_fragment_size
+    pool_size = args.pool_size
+    app.run()
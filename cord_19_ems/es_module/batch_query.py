@@ -0,0 +1,141 @@
+"""batch_query.py
+This module runs many queries offline, with the same query construction as the web interface
+(query.py's query_search: cross_fields text search, nested author filters, date range and
+language filter, and the 'more like this' searches). Queries are read from a file, sent in
+msearch batches from several threads, and their ranked results are written to a JSONL file, one
+line per query in input order. Throughput (queries/sec) and per-query latency are reported.
+It can be run as a script, or its functions used from other code:
+    python batch_query.py --queries_path queries.jsonl --out_path results.jsonl
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import argparse, json, time
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch_dsl.connections import connections
+import query
+from query import query_state, query_search, get_entity_neighbours, QUERY_FIELDS
+
+# fields of each ranked result written to the output, besides its id and score
+RESULT_FIELDS = ['title', 'publish_time', 'pr']
+
+
+def read_queries(path):
+    """
+    Reads query states from 'path', one query per line: either a JSON object with the fields of
+    the search forms (query.QUERY_FIELDS; e.g. {"query": "spike protein", "authors": "Li Wang",
+    "mindate": "2015", "in_english": true}) or plain text, which is a free text search.
+    """
+    states = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            values = json.loads(line) if line.startswith('{') else {'query': line}
+            # values may be given as numbers (dates, document ids), booleans or null; the forms send strings
+            values = {k: '' if v is None else str(v) for k, v in values.items() if k in QUERY_FIELDS}
+            states.append(query_state(values))
+    return states
+
+
+def reference_articles(es, states):
+    """ The citation keys of the reference articles of the 'more like this' by citations queries, by id. """
+    doc_ids = sorted({state['query'] for state in states if state['type'] == 'more_like_this_citations'})
+    if not doc_ids:
+        return {}
+    docs = es.mget(index=query.index_name, body={'ids': doc_ids}, _source_includes=['citation_keys'])['docs']
+    return {doc['_id']: doc.get('_source', {}) for doc in docs}
+
+
+def run_batch(es, states, size=10):
+    """
+    Runs a batch of queries as one msearch request. Returns, for each query, its raw response
+    (or {"error": ...} if it failed), and the seconds the request took.
+    """
+    articles = reference_articles(es, states)
+    neighbours = get_entity_neighbours() if any(state['type'] == 'more_like_this_entities' for state in states) else None
+    body = []
+    for state in states:
+        s = query_search(state, articles.get(state['query'], {}), neighbours)
+        body.append({'index': query.index_name})
+        body.append(s.source(includes=RESULT_FIELDS)[:size].to_dict())
+    start_t = time.perf_counter()
+    responses = es.msearch(body=body)['responses']
+    return responses, time.perf_counter() - start_t
+
+
+def run_queries(states, es=None, batch_size=50, concurrency=4, size=10):
+    """
+    Runs all queries in 'states', 'batch_size' per msearch request and 'concurrency' requests at a
+    time. Yields (state, response, seconds) for each query in input order, where seconds is the
+    latency of its msearch request.
+    """
+    es = es or connections.get_connection()
+    batches = [states[i:i + batch_size] for i in range(0, len(states), batch_size)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        for batch, (responses, elapsed_t) in zip(batches, pool.map(lambda b: run_batch(es, b, size), batches)):
+            for state, response in zip(batch, responses):
+                yield state, response, elapsed_t
+
+
+def result_record(state, response):
+    """ The output line of a query: the query, its number of hits and its ranked results, or its error. """
+    if 'error' in response:
+        return {'query': state, 'error': response['error']}
+    return {'query': state,
+            'total': response['hits']['total']['value'],
+            'took_ms': response['took'],
+            'results': [dict(hit.get('_source', {}), id=hit['_id'], score=hit['_score'])
+                        for hit in response['hits']['hits']]}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main():
+    connections.create_connection(hosts=[args.es_url], timeout=100, maxsize=args.concurrency)
+    query.index_name = args.index_name
+    query.neighbours_dir_path = args.neighbours_dir_path
+    states = read_queries(args.queries_path)
+
+    latencies, took, failed = [], [], 0
+    start_t = time.perf_counter()
+    with open(args.out_path, 'w') as f:
+        for state, response, elapsed_t in run_queries(states, batch_size=args.batch_size,
+                                                      concurrency=args.concurrency, size=args.size):
+            record = result_record(state, response)
+            f.write(json.dumps(record) + '\n')
+            latencies.append(elapsed_t)
+            if 'error' in record:
+                failed += 1
+            else:
+                took.append(record['took_ms'])
+    elapsed_t = time.perf_counter() - start_t
+
+    print(f'{len(states)} queries ({failed} failed) in {elapsed_t:0.2f} seconds: '
+          f'{len(states) / elapsed_t if elapsed_t else 0.0:0.1f} queries/sec')
+    print(f'latency per query (its msearch request): p50 {percentile(latencies, 0.5) * 1000:0.1f} ms, '
+          f'p99 {percentile(latencies, 0.99) * 1000:0.1f} ms')
+    print(f'elasticsearch time per query: p50 {percentile(took, 0.5):0.1f} ms, p99 {percentile(took, 0.99):0.1f} ms')
+    print('results written to', args.out_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a file of queries against the CORD-19 index in msearch batches")
+    parser.add_argument('--queries_path', help="File with one query per line: plain text or a JSON object of "
+                        "search form fields", required=True)
+    parser.add_argument('--out_path', help="JSONL file the ranked results are written to", default='results.jsonl')
+    parser.add_argument('--es_url', help="Elasticsearch to query", default='http://127.0.0.1:9200')
+    parser.add_argument('--index_name', help="Name of the index (alias) which you created when you ran index.py",
+                        default=query.index_name)
+    parser.add_argument('--neighbours_dir_path', help="Path to the entity neighbours directory written by index.py",
+                        default=query.neighbours_dir_path)
+    parser.add_argument('--size', help="Number of ranked results kept per query", type=int, default=10)
+    parser.add_argument('--batch_size', help="Number of queries per msearch request", type=int, default=50)
+    parser.add_argument('--concurrency', help="Number of msearch requests in flight", type=int, default=4)
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,104 @@
+"""cache.py
+This module caches result pages for query.py. Entries expire after a time-to-live and the least
+recently used ones are evicted once the cache is full. MemoryCache is private to each worker
+process; SQLiteCache keeps its entries in a local file, so several workers can share them.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import json, pickle, re, sqlite3, threading, time
+from collections import OrderedDict
+
+
+def cache_key(version, state, page):
+    """
+    Normalizes a query into a cache key: free text fields are lowercased with whitespace
+    collapsed, so trivially different spellings of the same query share an entry. 'version'
+    is the index version the results came from.
+    """
+    normalized = {field: re.sub(r"\s+", " ", value).strip().lower() for field, value in state.items()}
+    return json.dumps([version, normalized, page], sort_keys=True)
+
+
+class MemoryCache:
+    """ In-process LRU cache with a time-to-live of 'ttl' seconds per entry. """
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {"backend": type(self).__name__, "entries": len(self), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / max(self.hits + self.misses, 1)}
+
+
+class SQLiteCache(MemoryCache):
+    """ The same cache, with entries pickled into a sqlite file that worker processes can share. """
+    def __init__(self, path, max_entries=1024, ttl=300):
+        super(SQLiteCache, self).__init__(max_entries, ttl)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, value BLOB, "
+                          "created REAL, used REAL)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM pages WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE pages SET used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return pickle.loads(row[0])
+
+    def put(self, key, value):
+        with self.lock:
+            now = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                              (key, pickle.dumps(value), now, now))
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self.conn.execute("DELETE FROM pages WHERE key IN "
+                                  "(SELECT key FROM pages ORDER BY used LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM pages")
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
@@ -0,0 +1,194 @@
+"""corpus.py
+This module stores the CORD-19 papers on disk as sharded JSON lines, with an offset index,
+so the indexer can stream articles instead of unpickling the whole corpus into memory.
+The same scan records the citation edges, anchor text spans and body text prefix (for language
+detection) of each paper, so each source JSON file is parsed exactly once per build.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import json, os, hashlib
+from cord_19_ems.es_module.extras import timer, extract_anchor_spans, extract_citation_titles
+from cord_19_ems.es_module.language import body_text_prefix
+
+INDEX_FILE = 'index.json'
+EDGES_FILE = 'edges.jsonl'
+ANCHORS_FILE = 'anchors.jsonl'
+PREFIXES_FILE = 'prefixes.jsonl'
+
+
+@timer
+def write_corpus(data_dir, corpus_dir, shard_size=1000, prefix_chars=4000):
+    """
+    Walks 'data_dir' once, parsing each paper a single time, and writes under 'corpus_dir':
+      - numbered JSON lines shards holding the papers themselves
+      - an index recording, for each paper in order, its id, title, shard, byte offset and content hash
+      - the citation titles of each paper (for the citation graph)
+      - the cited title and surrounding sentence of each citation span (for anchor text)
+      - the first 'prefix_chars' characters of each paper's body text (for language detection)
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    papers = []
+    shard = None
+    edges_f = open(os.path.join(corpus_dir, EDGES_FILE), 'w')
+    anchors_f = open(os.path.join(corpus_dir, ANCHORS_FILE), 'w')
+    prefixes_f = open(os.path.join(corpus_dir, PREFIXES_FILE), 'w')
+    for dirname, subdirs, files in os.walk(data_dir):
+        for file in sorted(files):
+            if not file.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(dirname, file), 'r') as f:
+                    text_data = json.load(f)
+            except UnicodeDecodeError:
+                continue
+
+            # start a new shard every 'shard_size' papers
+            if len(papers) % shard_size == 0:
+                if shard is not None:
+                    shard.close()
+                shard_name = 'shard_%05d.jsonl' % (len(papers) // shard_size)
+                shard = open(os.path.join(corpus_dir, shard_name), 'wb')
+
+            # one line per paper in each side file, in the same order as the index
+            title = text_data['metadata']['title']
+            edges_f.write(json.dumps([title.lower(), extract_citation_titles(text_data)]) + '\n')
+            anchors_f.write(json.dumps(list(extract_anchor_spans(text_data))) + '\n')
+            prefixes_f.write(json.dumps(body_text_prefix(text_data, prefix_chars)) + '\n')
+
+            line = json.dumps(text_data).encode('utf-8')
+            papers.append([text_data['paper_id'], title, shard_name, shard.tell(), hashlib.sha1(line).hexdigest()])
+            shard.write(line + b'\n')
+    if shard is not None:
+        shard.close()
+    edges_f.close()
+    anchors_f.close()
+    prefixes_f.close()
+
+    with open(os.path.join(corpus_dir, INDEX_FILE), 'w') as f:
+        json.dump({"shard_size": shard_size, "prefix_chars": prefix_chars, "papers": papers}, f)
+
+    return Corpus(corpus_dir)
+
+
+class Corpus:
+    """
+    Read access to a corpus written by write_corpus. Iterating yields article dicts one at a
+    time, in index order, so only the index (ids and titles) is ever held in memory.
+    """
+    def __init__(self, corpus_dir):
+        self.corpus_dir = corpus_dir
+        with open(os.path.join(corpus_dir, INDEX_FILE), 'r') as f:
+            index = json.load(f)
+        self.papers = index['papers']
+        # corpora written before the prefixes were recorded have none
+        self.prefix_chars = index.get('prefix_chars', 0)
+        self._positions = {paper[0]: n for n, paper in enumerate(self.papers)}
+
+    def __len__(self):
+        return len(self.papers)
+
+    def __iter__(self):
+        shard_names = []
+        for _, _, shard_name, _, _ in self.papers:
+            if not shard_names or shard_names[-1] != shard_name:
+                shard_names.append(shard_name)
+        for shard_name in shard_names:
+            with open(os.path.join(self.corpus_dir, shard_name), 'rb') as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def __contains__(self, paper_id):
+        return paper_id in self._positions
+
+    def titles(self):
+        """ Titles of all papers, in index order. """
+        return [paper[1] for paper in self.papers]
+
+    def bibliographies(self):
+        """ Yields (title, cited titles) for each paper in index order, all lowercased. """
+        with open(os.path.join(self.corpus_dir, EDGES_FILE), 'r') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def citation_edges(self):
+        """ Yields (citing title, cited title) pairs, both lowercased. """
+        for title, citations in self.bibliographies():
+            for citation in citations:
+                yield title, citation
+
+    def anchor_spans(self):
+        """ Yields (citing paper number, cited title, surrounding sentence) for every citation span. """
+        with open(os.path.join(self.corpus_dir, ANCHORS_FILE), 'r') as f:
+            for i, line in enumerate(f):
+                for name, text in json.loads(line):
+                    yield i, name, text
+
+    def text_prefixes(self):
+        """ Yields (paper id, first prefix_chars characters of its body text) for each paper in index order. """
+        with open(os.path.join(self.corpus_dir, PREFIXES_FILE), 'r') as f:
+            for paper, line in zip(self.papers, f):
+                yield paper[0], json.loads(line)
+
+    def get(self, paper_id):
+        """ Reads a single article by paper id, seeking straight to it. """
+        _, _, shard_name, offset, _ = self.papers[self._positions[paper_id]]
+        with open(os.path.join(self.corpus_dir, shard_name), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+
+def load_manifest(path):
+    """ Loads the paper_id -> [document id, content hash, pagerank] manifest of the last build. """
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+
+
+def diff_manifest(manifest, corpus):
+    """
+    Compares a corpus against the manifest of the last build. Papers keep their document id
+    across builds; new papers get ids above any used before, so ids are never reused.
+    Returns the new manifest (with pagerank still to be filled in), the set of paper ids that
+    are new or whose content changed, and a dict of removed paper id -> document id.
+    """
+    next_id = max((entry[0] for entry in manifest.values()), default=-1) + 1
+    new_manifest = {}
+    changed = set()
+    for paper_id, _, _, _, content_hash in corpus.papers:
+        if paper_id in manifest:
+            doc_id, old_hash, _ = manifest[paper_id]
+            if old_hash != content_hash:
+                changed.add(paper_id)
+        else:
+            doc_id = next_id
+            next_id += 1
+            changed.add(paper_id)
+        new_manifest[paper_id] = [doc_id, content_hash, 0.0]
+    removed = {paper_id: entry[0] for paper_id, entry in manifest.items() if paper_id not in new_manifest}
+    return new_manifest, changed, removed
+
+
+def diff_anchor_titles(old_corpus, corpus, paper_ids):
+    """
+    Returns the cited titles whose anchor text differs between two corpora because of the papers
+    'paper_ids' (new, changed or removed): those the papers cite with different surrounding
+    sentences in the two versions, or in one version only.
+    """
+    spans = []
+    for c in (old_corpus, corpus):
+        by_title = {}
+        for i, name, text in c.anchor_spans():
+            if c.papers[i][0] in paper_ids:
+                by_title.setdefault((c.papers[i][0], name), []).append(text)
+        spans.append(by_title)
+    old_spans, new_spans = spans
+    return {name for paper_id, name in old_spans.keys() | new_spans.keys()
+            if old_spans.get((paper_id, name)) != new_spans.get((paper_id, name))}
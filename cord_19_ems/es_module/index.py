@@ -6,17 +6,26 @@ authors: Samantha Richards, Molly Moran, Emily Fountain
 """
 
 from __future__ import absolute_import
-import json, time, os, pickle, argparse, langid
+import time, os, re, shutil, argparse
+from itertools import chain
 from elasticsearch import Elasticsearch
 from elasticsearch import helpers
-from elasticsearch_dsl import Index, Document, Text, Integer, Float, Nested, InnerDoc, Boolean
+from elasticsearch_dsl import Index, Document, Text, Keyword, Integer, Float, Nested, Object, InnerDoc, Boolean
 from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl.analysis import analyzer, token_filter
-import networkx as nx
 #from cord_19_ems.notebooks.Citation_Network import generate_citation_graph
 from collections import defaultdict
+from multiprocessing import Pool
 import cord_19_ems.es_module.extras as utils
 from cord_19_ems.es_module.extras import timer
+from cord_19_ems.citation_graph.graph import CitationGraph
+from cord_19_ems.es_module.metadata import build_meta_store, MetaStore
+from cord_19_ems.es_module.language import detect_languages, is_english
+from cord_19_ems.es_module.neighbours import EntityNeighbours
+from cord_19_ems.es_module.anchors import build_anchor_store, AnchorStore
+from cord_19_ems.es_module.metrics import build_metrics, instrument_transport, profiled
+from cord_19_ems.es_module.corpus import (Corpus, write_corpus, load_manifest, save_manifest, diff_manifest,
+                                          diff_anchor_titles)
 from collections import Counter
 
 # connect to local host server
@@ -26,6 +35,9 @@ connections.create_connection(hosts=['127.0.0.1'])
 es = Elasticsearch(timeout=100, max_retries=100, retry_on_timeout=True, mapping_nested_objects_limit=15000)
 
 
+# number of leading characters of body_text stored for display on result pages
+SNIPPET_CHARS = 500
+
 entity_types = {'GPE', 'BACTERIUM', 'LOC', 'TISSUE', 'GENE_OR_GENOME',
                 'IMMUNE_RESPONSE', 'VIRAL_PROTEIN', 'CELL_OR_MOLECULAR_DYSFUNCTION', 'ORGANISM',
                 'CELL_FUNCTION','DISEASE_OR_SYNDROME', 'MOLECULAR_FUNCTION', 'CELL_COMPONENT',
@@ -70,7 +82,9 @@ class Article(Document):
     abstract = Text(analyzer=text_analyzer)
     body = Nested(Section)
     body_text = Text(analyzer=text_analyzer)
+    snippet = Text(index=False)             # start of body_text, shown on result pages without an abstract
     citations = Nested(Citation)            # citations field is a Nested list of Citation objects
+    citation_keys = Keyword()               # citation_key() of each cited title, for citation overlap search
     pr = Float(doc_values=True)
     cited_by = Nested(AnchorText)
     anchor_text = Text(analyzer='standard')
@@ -83,127 +97,446 @@ class Article(Document):
         return super(Article, self).save(*args, **kwargs)
 
 
+# "lean" mapping profile: fields that are only displayed (on the document page) are kept in _source
+# but not indexed, and the citation lists are plain objects instead of nested documents, which
+# removes the hidden Lucene document per citation. The body sections are not analyzed themselves;
+# their text is copied into body_text, which is therefore left out of _source instead of being
+# sent and stored a second time. Authors stay nested, since the author filter matches first and
+# last names of the same author.
+class LeanSection(InnerDoc):
+    text = Text(index=False, copy_to='body_text')
+    name = Keyword(index=False, doc_values=False)
+
+class LeanArticle(Article):
+    id_num = Keyword(index=False, doc_values=False)
+    body = Object(LeanSection)
+    journal = Keyword(index=False, doc_values=False)
+
+# the citation lists are stored but not mapped. They are set on the mapping once the class exists,
+# since a field declared in the class would be merged with Article's Citation and AnchorText
+# properties, leaving their nested authors mapper under the disabled object
+for name in ('citations', 'cited_by'):
+    LeanArticle._doc_type.mapping.field(name, Object(enabled=False))
+
+
+# mapping profiles selectable with --mapping
+MAPPINGS = {'full': Article, 'lean': LeanArticle}
+
+# query.py pages a paper's nested sections, citations and citing sentences as inner hits, which
+# Elasticsearch limits to the first 100 of each list by default (index.max_inner_result_window)
+MAX_INNER_RESULT_WINDOW = 10000
+
+# what is indexed for the fields highlighted on result pages, selectable with --highlighting.
+# without offsets the highlighter re-analyzes each hit's field at query time; 'offsets' stores
+# them in the postings (read by the unified highlighter), 'term_vectors' stores per-document
+# term vectors with offsets (needed by the fvh highlighter, and larger)
+HIGHLIGHT_FIELDS = ['title', 'abstract']
+HIGHLIGHTING = {'none': {}, 'offsets': {"index_options": "offsets"},
+                'term_vectors': {"term_vector": "with_positions_offsets"}}
+
+
 # populate the index
 @timer
 def build_index():
     """
-    buildIndex creates a new film index, deleting any existing index of
-    the same name.
-    It loads a json file containing the movie corpus and does bulk loading
-    using a generator function.
+    build_index creates a new, timestamped version of the index and bulk loads the corpus
+    into it using a generator function. Once the load is done, the alias named by --index_name
+    (which query.py searches) is moved onto the new version in one atomic step, so search
+    keeps working against the previous version for the whole build.
+    """
+    version_name = '%s_%s' % (args.index_name, time.strftime('%Y%m%d%H%M%S'))
+    create_index(version_name, args.mapping, args.highlighting)
+
+    # open the on-disk corpus; articles are streamed from it rather than loaded into memory
+    corpus = Corpus(os.path.join(args.module_dir_path, 'corpus'))
+    doc_ids = list(range(len(corpus)))
+    context = load_context(corpus, doc_ids, version_name)
+
+    actions = generate_actions(enumerate(corpus), context, args.workers, args.chunk_size)
+    bulk_load(actions, args.bulk_threads, args.chunk_size, args.bulk_retries)
+
+    # record what was indexed, so the next release can be applied incrementally
+    manifest = {paper[0]: [doc_ids[n], paper[4], context['pagerank'][paper[1].lower()]]
+                for n, paper in enumerate(corpus.papers)}
+    save_manifest(os.path.join(args.module_dir_path, 'manifest.json'), manifest)
+
+    # the new version's neighbours are in place before search is pointed at it
+    build_neighbours(corpus, doc_ids, context['meta'], version_name)
+    finish_index(version_name)
+    swap_alias(version_name)
+    remove_old_versions()
+
+
+def create_index(version_name, mapping='full', highlighting='none'):
+    """
+    Creates an index version with the given mapping profile and highlighting support, which are
+    recorded in the mapping's _meta.
+    """
+    article_index = Index(version_name, using=es)
+    article_index.document(MAPPINGS[mapping])  # register the document mapping
+    # no refreshes or replicas during the bulk load; both are restored by finish_index
+    article_index.settings(refresh_interval='-1', number_of_replicas=0,
+                           max_inner_result_window=MAX_INNER_RESULT_WINDOW)
+    body = article_index.to_dict()
+    for name in HIGHLIGHT_FIELDS:
+        body['mappings']['properties'][name].update(HIGHLIGHTING[highlighting])
+    body['mappings']['_meta'] = {"mapping": mapping, "highlighting": highlighting}
+    es.indices.create(index=version_name, body=body)
+
+
+def mapping_profile(index_name):
+    """ The mapping profile an existing index was created with ('full' for indices older than profiles). """
+    for mappings in es.indices.get_mapping(index=index_name).values():
+        return mappings['mappings'].get('_meta', {}).get('mapping', 'full')
+
+
+def finish_index(version_name):
+    """ Restores search settings on a freshly loaded index version and merges its segments. """
+    es.indices.put_settings(index=version_name, body={"index": {"refresh_interval": args.refresh_interval,
+                                                                "number_of_replicas": args.replicas}})
+    es.indices.refresh(index=version_name)
+    es.indices.forcemerge(index=version_name, max_num_segments=1, request_timeout=3600)
+
+
+def swap_alias(version_name):
+    """ Points the --index_name alias at 'version_name', and away from any older version, atomically. """
+    actions = [{"add": {"index": version_name, "alias": args.index_name}}]
+    if es.indices.exists_alias(name=args.index_name):
+        for old_version in es.indices.get_alias(name=args.index_name):
+            actions.insert(0, {"remove": {"index": old_version, "alias": args.index_name}})
+    elif es.indices.exists(index=args.index_name):
+        # an index built before versioning holds the alias's name; drop it in the same step
+        actions.insert(0, {"remove_index": {"index": args.index_name}})
+    es.indices.update_aliases(body={"actions": actions})
+
+
+def remove_old_versions():
+    """ Deletes all but the newest --keep_versions versions of the index, never the live one. """
+    pattern = re.compile(re.escape(args.index_name) + r"_\d{14}$")
+    versions = sorted(name for name in es.indices.get(index=args.index_name + '_*') if pattern.match(name))
+    live = set(es.indices.get_alias(name=args.index_name))
+    for old_version in versions[:max(len(versions) - args.keep_versions, 0)]:
+        if old_version not in live:
+            es.indices.delete(index=old_version)
+            shutil.rmtree(os.path.join(args.module_dir_path, 'neighbours', old_version), ignore_errors=True)
+
+
+def bump_update(version_name):
+    """
+    Increments the update counter in the _meta of an index version's mapping. query.py keys its
+    result cache on it, so cached pages are dropped after an incremental update of the live index.
+    """
+    meta = {}
+    for mappings in es.indices.get_mapping(index=version_name).values():
+        meta = mappings['mappings'].get('_meta', {})
+    meta['update'] = meta.get('update', 0) + 1
+    # put_mapping replaces the whole _meta, so the mapping and highlighting profiles are written back too
+    es.indices.put_mapping(index=version_name, body={"_meta": meta})
+
+
+def live_version():
+    """ The index version behind the --index_name alias (the index itself, if it was built before versioning). """
+    if es.indices.exists_alias(name=args.index_name):
+        return sorted(es.indices.get_alias(name=args.index_name))[-1]
+    return args.index_name
+
+
+@timer
+def update_index(old_corpus, corpus):
+    """
+    Applies a new corpus scan to the existing index without rebuilding it. Papers whose
+    content hash is unchanged keep their documents; new and changed papers are upserted,
+    removed papers are deleted, and so are their neighbours: papers citing a title that
+    appeared, disappeared or moved to another document (their 'in_corpus' links change) and
+    papers cited in a sentence that a changed paper altered (their anchor text changes).
+    Pagerank is recomputed for the whole graph, but only written to documents whose score moved
+    by more than --pagerank_tolerance.
+    """
+    manifest_path = os.path.join(args.module_dir_path, 'manifest.json')
+    old_manifest = load_manifest(manifest_path)
+    manifest, changed, removed = diff_manifest(old_manifest, corpus)
+    doc_ids = [manifest[paper[0]][0] for paper in corpus.papers]
+
+    # titles that appeared, disappeared or now name another document, so the 'in_corpus' links of
+    # papers citing them change (titles map to document ids as in load_context's titles_to_ids)
+    old_ids = {paper[1].lower(): old_manifest[paper[0]][0] for paper in old_corpus.papers}
+    new_ids = {paper[1].lower(): doc_ids[n] for n, paper in enumerate(corpus.papers)}
+    affected_titles = {title for title in old_ids.keys() | new_ids.keys() if old_ids.get(title) != new_ids.get(title)}
+
+    # papers cited by a changed paper with different citing sentences have gained or lost anchor text
+    cited = diff_anchor_titles(old_corpus, corpus, changed | set(removed))
+
+    rebuild = [n for n, (title, citations) in enumerate(corpus.bibliographies())
+               if corpus.papers[n][0] in changed or title in cited or affected_titles.intersection(citations)]
+
+    context = load_context(corpus, doc_ids, args.index_name, mapping_profile(args.index_name))
+    for paper in corpus.papers:
+        manifest[paper[0]][2] = context['pagerank'][paper[1].lower()]
+
+    rebuilt = set(rebuild)
+    pagerank_updates = [n for n, paper in enumerate(corpus.papers) if n not in rebuilt and
+                        abs(manifest[paper[0]][2] - old_manifest[paper[0]][2]) > args.pagerank_tolerance]
+    print(f'{len(changed)} new or changed, {len(removed)} removed, {len(rebuild) - len(changed)} neighbours '
+          f'rebuilt, {len(pagerank_updates)} pagerank updates')
+
+    deletes = ({"_op_type": 'delete', "_index": args.index_name, "_type": '_doc', "_id": doc_id}
+               for doc_id in removed.values())
+    documents = generate_actions(((doc_ids[n], corpus.get(corpus.papers[n][0])) for n in rebuild),
+                                 context, args.workers, args.chunk_size)
+    updates = ({"_op_type": 'update', "_index": args.index_name, "_type": '_doc', "_id": doc_ids[n],
+                "doc": {"pr": manifest[corpus.papers[n][0]][2]}} for n in pagerank_updates)
+    bulk_load(chain(deletes, documents, updates), args.bulk_threads, args.chunk_size, args.bulk_retries)
+
+    save_manifest(manifest_path, manifest)
+    version_name = live_version()
+    build_neighbours(corpus, doc_ids, context['meta'], version_name)
+    es.indices.refresh(index=version_name)
+    bump_update(version_name)
+
+
+@timer
+def build_neighbours(corpus, doc_ids, meta_store, version_name):
+    """
+    Precomputes the --neighbours_k papers most similar to each paper by their entities, and
+    writes them to neighbours/<version_name> in the module directory, where query.py looks
+    them up for 'more like this' by entities, in the directory of the index version behind
+    the alias. 'doc_ids' gives the document id of each paper, by position in the corpus.
     """
-    article_index = Index(args.index_name)
-    if article_index.exists():
-        article_index.delete()  # overwrite any previous version
-    article_index.document(Article)  # register the document mapping
-    article_index.create()
+    docs = []
+    for paper in corpus.papers:
+        meta = meta_store.get(paper[0])
+        docs.append(meta['ents'].lower().split() if meta is not None else [])
+    neighbours = EntityNeighbours.build(docs, doc_ids, args.neighbours_k, args.neighbours_max_df)
+    neighbours.save(os.path.join(args.module_dir_path, 'neighbours', version_name))
+
 
-    with open(os.path.join(args.module_dir_path, 'graph.p'), 'rb') as f:
-        citation_graph = pickle.load(f)
-    pagerank_scores = nx.pagerank(citation_graph)
+def load_context(corpus, doc_ids, index_name, mapping=None):
+    """
+    Loads what each document needs from the rest of the corpus: pagerank scores, the map from
+    titles to document ids, anchor text, the per-sha metadata and the language of each
+    paper. 'doc_ids' gives the document
+    id of each paper, by position in the corpus, and 'index_name' the index it is written to,
+    with mapping profile 'mapping' (--mapping by default).
+    """
+    citation_graph = CitationGraph.load(os.path.join(args.module_dir_path, 'graph'))
+    with build_metrics.stage('pagerank'):
+        pagerank_scores = citation_graph.pagerank(damping=args.pagerank_damping, tol=args.pagerank_convergence)
     ddict = defaultdict(float, pagerank_scores)
 
-    # load articles from data source
-    with open(os.path.join(args.module_dir_path, 'articles.p'), 'rb') as f:
-        articles = pickle.load(f)
-
-    # build a default dictionary to map titles do ids (for eventual use in citations 'more like this')
-    titles_to_ids = {v['metadata']['title'].lower(): k for k, v in enumerate(articles.values())}
-    titles_to_ids = defaultdict(lambda: -1, titles_to_ids)  # -1 is default value for a key error
-
-    # get anchor text:
-    anchor_text_dict = utils.get_anchor_text(articles, titles_to_ids)
-
-    # open ner and metadata dict
-    with open(args.meta_ner_path, 'r') as f:
-        meta_ner_all = json.load(f)
-
-    # get entity frequencies (to filter out unique entities)
-    ent_freqs = utils.get_entity_counts(meta_ner_all)
-
-    def actions():
-        for i, article in enumerate(articles.values()):
-            sha = article['paper_id']
-
-            # extract contents of entity and metadata dict
-            if sha in set(meta_ner_all.keys()):  # entities, source, doi, publish_time, has_full_text, journal
-                ents = []
-                for type, entlist in meta_ner_all[sha]['entities'].items():
-                    if type in entity_types:
-                        ents.extend(entlist)
-                ents = [ent for ent in ents if ent_freqs[ent] > 1]  # get only ents that occur > 1 in corpus
-                ents_str = utils.untokenize(ents)  # transform to string type for indexing
-
-                publish_time = utils.extract_year(meta_ner_all[sha]["publish_time"])
-                journal = meta_ner_all[sha]['journal']
-            else:
-                publish_time = 0
-                ents_str = ''
-                journal = ''
-
-            # extract contents of article dict
-            title = article['metadata']['title'] if 'title' in article['metadata'].keys() else '(Untitled)'
-            cits = article['bib_entries'] if 'bib_entries' in article.keys() else [{}]
-            cits = [{"title": cit['title'], "year": cit['year'], "in_corpus": titles_to_ids[cit['title'].lower()],
-                     "authors": [{"first": auth['first'], "last": auth["last"]} for auth in cit['authors']]} for cit in cits.values() if cit['title'] != '']
-            authors = [{"first": auth['first'], "last": auth["last"]} for auth in article['metadata']['authors']]
-            pr = ddict[article['metadata']['title'].lower()]
-            abstract = ' '.join([abs['text'] if 'text' in abs.keys() else '' for abs in article['abstract']]) if 'abstract' in article.keys() else ''
-            anchor_text = ' '.join([cit['text'] for cit in anchor_text_dict[title.lower()]])
-            section_dict = defaultdict(list)
-            for txt in article['body_text']:
-                section = txt['section']
-                section_dict[section].append(txt['text'])
-            body = [{"name": k, "text": v} for k,v in section_dict.items()]
-            cited_by = anchor_text_dict[title.lower()]
-
-            body_text = ' '.join([sect['text'] for sect in article['body_text']])
-
-            # check that article is in English
-            in_english = (langid.classify(body_text)[0] == 'en')
-
-            yield {
-                "_index": args.index_name,
-                "_type": '_doc',
-                "_id": i,
-                "title": title,
-                "id_num": sha,
-                "abstract": abstract,
-                "body": body,
-                "body_text": body_text,
-                "authors": authors,
-                "publish_time": publish_time,
-                "journal": journal,
-                "citations": cits,
-                "in_english": in_english,
-                "pr": pr,
-                "anchor_text": anchor_text,
-                "cited_by": cited_by,
-                "ents": ents_str,
-            }
-
-    helpers.bulk(es, actions(), raise_on_error=True)  # one doc in corpus contains a NAN value and it has to be ignored.
-
-
-# command line invocation builds index and prints the running time.
+    # build a dictionary to map titles do ids (for eventual use in citations 'more like this')
+    # a plain dict (rather than a defaultdict with a lambda) so it can be handed to worker processes
+    titles_to_ids = {title.lower(): doc_ids[k] for k, title in enumerate(corpus.titles())}
+
+    # collect anchor text into a store that documents read from by title
+    anchor_store_path = os.path.join(args.module_dir_path, 'anchors.db')
+    build_anchor_store(corpus, titles_to_ids, anchor_store_path, doc_ids)
+
+    # per-sha entity string, year and journal, joined and filtered ahead of time
+    meta_store = MetaStore(args.meta_ner_path)
+
+    # check which articles are in English
+    in_english = detect_languages(corpus, os.path.join(args.module_dir_path, 'languages.json'),
+                                  args.langid_chars, args.workers, args.chunk_size)
+
+    return {'index_name': index_name, 'pagerank': ddict, 'titles_to_ids': titles_to_ids,
+            'anchors': AnchorStore(anchor_store_path), 'cited_by_limit': args.cited_by_limit,
+            'meta': meta_store, 'in_english': in_english, 'mapping': mapping or args.mapping}
+
+
+def build_document(i, article, context):
+    """
+    Builds the bulk action for a single article. Everything the document needs from the rest of
+    the corpus (pagerank, anchor text, entities) is read from 'context', so this can run in a worker process.
+    The time spent on each part of the document is recorded in build_metrics.
+    """
+    sha = article['paper_id']
+    titles_to_ids = context['titles_to_ids']
+    build_metrics.count('docs.built')
+
+    # extract contents of the precomputed entity and metadata record
+    with build_metrics.stage('document.metadata'):
+        meta = context['meta'].get(sha)
+    if meta is not None:
+        ents_str = meta['ents']
+        publish_time = meta['publish_time']
+        journal = meta['journal']
+    else:
+        publish_time = 0
+        ents_str = ''
+        journal = ''
+
+    # extract contents of article dict
+    title = article['metadata']['title'] if 'title' in article['metadata'].keys() else '(Untitled)'
+    with build_metrics.stage('document.citations'):
+        cits = article['bib_entries'] if 'bib_entries' in article.keys() else {}
+        cits = [{"title": cit['title'], "year": cit['year'], "in_corpus": titles_to_ids.get(cit['title'].lower(), -1),
+                 "authors": [{"first": auth['first'], "last": auth["last"]} for auth in cit['authors']]} for cit in cits.values() if cit['title'] != '']
+        citation_keys = sorted(set(utils.citation_key(cit['title']) for cit in cits))
+    build_metrics.count('citations', len(cits))
+    authors = [{"first": auth['first'], "last": auth["last"]} for auth in article['metadata']['authors']]
+    pr = context['pagerank'][article['metadata']['title'].lower()]
+    abstract = ' '.join([abs['text'] if 'text' in abs.keys() else '' for abs in article['abstract']]) if 'abstract' in article.keys() else ''
+    # all citing sentences are searchable as anchor text, but only the first few are stored
+    # as nested cited_by objects, for display on the document page
+    with build_metrics.stage('document.anchor_text'):
+        cited_by = context['anchors'].get(title.lower())
+        anchor_text = ' '.join([cit['text'] for cit in cited_by])
+        cited_by = cited_by[:context['cited_by_limit']]
+    build_metrics.count('anchor_sentences', len(cited_by))
+
+    with build_metrics.stage('document.body'):
+        section_dict = defaultdict(list)
+        for txt in article['body_text']:
+            section = txt['section']
+            section_dict[section].append(txt['text'])
+        body = [{"name": k, "text": v} for k,v in section_dict.items()]
+
+        body_text = ' '.join([sect['text'] for sect in article['body_text']])
+
+    # check that article is in English, if the language stage has not already
+    in_english = context['in_english'].get(sha)
+    if in_english is None:
+        build_metrics.count('langid.fallbacks')
+        with build_metrics.stage('document.langid'):
+            in_english = is_english(body_text)
+
+    document = {
+        "_index": context['index_name'],
+        "_type": '_doc',
+        "_id": i,
+        "title": title,
+        "id_num": sha,
+        "abstract": abstract,
+        "body": body,
+        "body_text": body_text,
+        "snippet": body_text[:SNIPPET_CHARS],
+        "authors": authors,
+        "publish_time": publish_time,
+        "journal": journal,
+        "citations": cits,
+        "citation_keys": citation_keys,
+        "in_english": in_english,
+        "pr": pr,
+        "anchor_text": anchor_text,
+        "cited_by": cited_by,
+        "ents": ents_str,
+    }
+    # the lean mapping fills body_text from the body sections
+    if context['mapping'] == 'lean':
+        del document['body_text']
+    return document
+
+
+# per-process copy of the build context, set once by the pool initializer
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _build_chunk(chunk):
+    """ Builds a chunk of documents, and returns them with the worker's measurements for this chunk. """
+    build_metrics.reset()
+    return [build_document(i, article, _worker_context) for i, article in chunk], build_metrics.snapshot()
+
+
+def generate_actions(numbered_articles, context, workers=1, chunk_size=500):
+    """
+    Yields bulk actions for (id, article) pairs. With more than one worker, documents are built
+    in a process pool, a chunk at a time, with at most 2 chunks per worker in flight.
+    """
+    if workers <= 1:
+        for i, article in numbered_articles:
+            yield build_document(i, article, context)
+        return
+
+    with Pool(workers, initializer=_init_worker, initargs=(context,)) as pool:
+        chunks = utils.chunked(numbered_articles, chunk_size)
+        for docs, worker_metrics in utils.bounded_imap(pool, _build_chunk, chunks, max_pending=2 * workers):
+            build_metrics.merge(worker_metrics)
+            yield from docs
+
+
+@timer
+def bulk_load(actions, bulk_threads=1, chunk_size=500, max_retries=0):
+    """
+    Sends actions to elasticsearch and reports throughput. Failed documents are counted per
+    chunk and reported at the end, rather than aborting the whole load on the first error.
+    With a single thread, documents rejected because elasticsearch's bulk queue is full are
+    retried up to 'max_retries' times, with exponential backoff.
+    """
+    if bulk_threads > 1:
+        responses = helpers.parallel_bulk(es, actions, thread_count=bulk_threads, chunk_size=chunk_size,
+                                          queue_size=bulk_threads, raise_on_error=False, raise_on_exception=False)
+    else:
+        responses = helpers.streaming_bulk(es, actions, chunk_size=chunk_size, max_retries=max_retries,
+                                           raise_on_error=False, raise_on_exception=False)
+
+    start_t = time.perf_counter()
+    indexed = 0
+    failed_chunks = Counter()
+    for n, (ok, info) in enumerate(responses):
+        if ok:
+            indexed += 1
+        else:
+            # one doc in corpus contains a NAN value and it has to be ignored.
+            failed_chunks[n // chunk_size] += 1
+            print('failed to index document:', info)
+    elapsed_t = time.perf_counter() - start_t
+
+    failed = sum(failed_chunks.values())
+    build_metrics.count('docs.indexed', indexed)
+    build_metrics.count('docs.failed', failed)
+    print(f'indexed {indexed} documents ({failed} failed in {len(failed_chunks)} chunks), '
+          f'{indexed / elapsed_t if elapsed_t else 0:0.1f} docs/sec')
+    for chunk, count in sorted(failed_chunks.items()):
+        print(f'  chunk {chunk}: {count} failed')
+    return indexed, failed
+
+
+# command line invocation builds index, prints the running time and writes a report of the build.
 def main():
+    instrument_transport(es)
+    report_dir = os.path.join(args.module_dir_path, 'reports')
+    with profiled(args.profile, report_dir):
+        mode = run_pipeline()
+    report = build_metrics.write_report(report_dir, mode=mode, index_name=args.index_name, settings=vars(args))
+    print('build report written to', report)
+
+
+def run_pipeline():
+    """ Runs each stage of the build that is needed, and returns 'incremental' or 'full'. """
     # if extra datafiles have not been cross-referenced, do this
     if not os.path.isfile(args.meta_ner_path):
-        utils.all_ner_metadata_cross_reference(args.metadata_path, args.ner_path, args.meta_ner_path)
+        build_meta_store(args.metadata_path, args.ner_path, entity_types, args.meta_ner_path)
+    corpus_dir = os.path.join(args.module_dir_path, 'corpus')
+    # apply a new release to an existing index: scan it next to the previous one and compare them
+    if args.incremental and os.path.exists(corpus_dir) and Index(args.index_name).exists() \
+            and os.path.isfile(os.path.join(args.module_dir_path, 'manifest.json')):
+        write_corpus(args.data_dir_path, corpus_dir + '.new', prefix_chars=args.langid_chars)
+        utils.generate_citation_graph(Corpus(corpus_dir + '.new'), args.module_dir_path)
+        update_index(Corpus(corpus_dir), Corpus(corpus_dir + '.new'))
+        shutil.rmtree(corpus_dir)
+        os.rename(corpus_dir + '.new', corpus_dir)
+        return 'incremental'
+    # if the on-disk corpus has not been created, do so
+    if not os.path.exists(corpus_dir):
+        write_corpus(args.data_dir_path, corpus_dir, prefix_chars=args.langid_chars)
     # if citation graph has not been created, do this
-    if not os.path.isfile(os.path.join(args.module_dir_path, 'graph.p')):
-        utils.generate_citation_graph(args.data_dir_path, args.module_dir_path)
-    # if the dict of articles has not been created, do so
-    if not os.path.exists(os.path.join(args.module_dir_path, 'articles.p')):
-        utils.load_dataset_to_dict(args.module_dir_path, args.data_dir_path)
+    if not os.path.exists(os.path.join(args.module_dir_path, 'graph')):
+        utils.generate_citation_graph(Corpus(corpus_dir), args.module_dir_path)
     # build index
     build_index()
+    return 'full'
 
 
-if __name__ == '__main__':
+def build_parser():
+    """ The command line options of the build, also used by the benchmarks to configure its stages. """
     parser = argparse.ArgumentParser(description="Setup and create index for CORD-19 ES")
-    parser.add_argument('--index_name', help="Name of index that will be created by running this program",
-                        default="another_covid_index")
+    parser.add_argument('--index_name', help="Name of the alias that will point at the index created by running "
+                        "this program", default="another_covid_index")
     parser.add_argument('--module_dir_path', help="Relative path to the directory es_module",
                         default='')
     parser.add_argument('--data_dir_path', help="Path to directory which holds CORD-19 data files",
@@ -212,7 +545,48 @@ if __name__ == '__main__':
                         default="../data_extras/all_sources_metadata_2020-03-13.csv")
     parser.add_argument('--ner_path', help="Path to json file which holds the CORD-NER data",
                         default="../data_extras/CORD-NER-ner.json")
-    parser.add_argument('--meta_ner_path', help="Path to json file where cross-referenced data will be output",
-                        default="../data_extras/cross_ref_data_all_sources.json")
-    args = parser.parse_args()
+    parser.add_argument('--meta_ner_path', help="Path to sqlite file where cross-referenced data will be output",
+                        default="../data_extras/cross_ref_data_all_sources.db")
+    parser.add_argument('--workers', help="Number of processes used to build documents (1 builds them in-process)",
+                        type=int, default=1)
+    parser.add_argument('--bulk_threads', help="Number of threads sending bulk requests to elasticsearch",
+                        type=int, default=1)
+    parser.add_argument('--chunk_size', help="Number of documents per worker task and per bulk request",
+                        type=int, default=500)
+    parser.add_argument('--mapping', help="Mapping profile of a new index: 'lean' leaves display-only fields "
+                        "unindexed and does not store body_text twice", choices=sorted(MAPPINGS), default='full')
+    parser.add_argument('--highlighting', help="Highlighting support indexed for titles and abstracts: 'offsets' "
+                        "for the unified highlighter, 'term_vectors' for fvh, 'none' to re-analyze them per hit",
+                        choices=sorted(HIGHLIGHTING), default='offsets')
+    parser.add_argument('--bulk_retries', help="Times documents rejected by a full elasticsearch bulk queue are "
+                        "retried (single bulk thread only)", type=int, default=3)
+    parser.add_argument('--profile', help="Profile the build, writing the profile next to the build reports",
+                        choices=['cprofile', 'pyinstrument'])
+    parser.add_argument('--incremental', help="Update the existing index from a new release of the data instead of "
+                        "rebuilding it, re-indexing only new, changed and removed papers and their neighbours",
+                        action='store_true')
+    parser.add_argument('--pagerank_tolerance', help="In incremental mode, smallest pagerank change written to "
+                        "documents that are otherwise unchanged", type=float, default=1e-7)
+    parser.add_argument('--langid_chars', help="Number of leading characters of each paper used to detect its language",
+                        type=int, default=4000)
+    parser.add_argument('--pagerank_damping', help="Damping factor of the citation graph pagerank",
+                        type=float, default=0.85)
+    parser.add_argument('--pagerank_convergence', help="Per-node tolerance at which pagerank iteration stops",
+                        type=float, default=1e-6)
+    parser.add_argument('--cited_by_limit', help="Largest number of citing sentences stored in each document's nested "
+                        "cited_by field (0 leaves it empty; all of them are still searchable as anchor text)",
+                        type=int, default=50)
+    parser.add_argument('--neighbours_k', help="Number of entity neighbours precomputed per paper, for 'more like this'",
+                        type=int, default=100)
+    parser.add_argument('--neighbours_max_df', help="Entities in more than this fraction of papers are ignored "
+                        "when computing entity neighbours", type=float, default=0.2)
+    parser.add_argument('--keep_versions', help="Number of most recent index versions to keep (the live one is "
+                        "always kept)", type=int, default=2)
+    parser.add_argument('--replicas', help="Number of replicas of the index once it is built", type=int, default=1)
+    parser.add_argument('--refresh_interval', help="Refresh interval of the index once it is built", default='1s')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
     main()
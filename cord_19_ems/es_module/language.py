@@ -0,0 +1,82 @@
+"""language.py
+This module runs language detection as its own stage of the index pipeline. Only a bounded
+prefix of each paper's text is classified, the work is spread over a process pool, and results
+are cached by paper id and content hash, so unchanged papers are never classified again.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import json, os, time, langid
+from multiprocessing import Pool
+from cord_19_ems.es_module.extras import timer, chunked, bounded_imap
+
+
+def body_text_prefix(article, max_chars):
+    """ The first 'max_chars' characters of an article's body text, as it is indexed. """
+    prefix = ''
+    for sect in article['body_text']:
+        if len(prefix) >= max_chars:
+            break
+        prefix = prefix + ' ' + sect['text'] if prefix else sect['text']
+    return prefix[:max_chars]
+
+
+def is_english(text):
+    return langid.classify(text)[0] == 'en'
+
+
+def _classify_chunk(chunk):
+    return [(paper_id, is_english(text)) for paper_id, text in chunk]
+
+
+@timer
+def detect_languages(corpus, cache_path, max_chars=4000, workers=1, chunk_size=500):
+    """
+    Returns a dict of paper id -> True if the paper is in English. Results are read from and
+    written back to the cache at 'cache_path', keyed by paper id and the content hash recorded
+    by the corpus scan; the cache is discarded if it was built with a different 'max_chars'.
+    """
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        if cached['max_chars'] == max_chars:
+            cache = cached['papers']
+
+    in_english = {}
+    misses = set()
+    for paper_id, _, _, _, content_hash in corpus.papers:
+        if paper_id in cache and cache[paper_id][0] == content_hash:
+            in_english[paper_id] = cache[paper_id][1]
+        else:
+            misses.add(paper_id)
+
+    # seek to a handful of papers; when most of the corpus needs classifying, stream the prefixes
+    # recorded by the corpus scan instead of parsing every paper again
+    if len(misses) < len(corpus) // 10:
+        texts = ((paper_id, body_text_prefix(corpus.get(paper_id), max_chars)) for paper_id in misses)
+    elif max_chars <= corpus.prefix_chars:
+        texts = ((paper_id, prefix[:max_chars]) for paper_id, prefix in corpus.text_prefixes() if paper_id in misses)
+    else:
+        texts = ((article['paper_id'], body_text_prefix(article, max_chars))
+                 for article in corpus if article['paper_id'] in misses)
+
+    start_t = time.perf_counter()
+    if workers <= 1:
+        results = _classify_chunk(texts)
+    else:
+        with Pool(workers) as pool:
+            chunks = bounded_imap(pool, _classify_chunk, chunked(texts, chunk_size), max_pending=2 * workers)
+            results = [result for chunk in chunks for result in chunk]
+    elapsed_t = time.perf_counter() - start_t
+    in_english.update(results)
+    print(f'classified {len(results)} papers ({len(corpus) - len(misses)} cached), '
+          f'{len(results) / elapsed_t if elapsed_t else 0:0.1f} docs/sec')
+
+    hashes = {paper[0]: paper[4] for paper in corpus.papers}
+    with open(cache_path, 'w') as f:
+        json.dump({"max_chars": max_chars,
+                   "papers": {paper_id: [hashes[paper_id], english] for paper_id, english in in_english.items()}}, f)
+
+    return in_english
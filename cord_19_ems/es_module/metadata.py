@@ -0,0 +1,102 @@
+"""metadata.py
+This module joins the CORD-NER entities and the metadata csv to paper shas without holding
+either in memory: the csv is read first to map NER doc ids to shas, then the NER json lines
+file is streamed and one filtered record per sha is written to a sqlite store, which the
+indexer reads lazily.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import csv, os, sqlite3, jsonlines
+from collections import Counter
+from cord_19_ems.es_module.extras import timer, filter_entities, extract_year, untokenize
+
+
+def read_metadata_rows(metadata_csv):
+    """
+    Maps each row index of the metadata csv to (sha, publish year, journal). The index of each
+    line in the csv corresponds to the doc_ids in the NER json lines file.
+    """
+    rows = {}
+    with open(metadata_csv, 'r') as csvf:
+        reader = csv.reader(csvf)
+        next(reader)
+        for i, line in enumerate(reader):
+            sha = line[0]
+            if sha:
+                rows[i] = (sha, extract_year(line[8]), line[10])
+    return rows
+
+
+def stream_ner_entities(ner_json):
+    """ Yields (doc_id, {type: cleaned entity list}) for each document in the NER file. """
+    with jsonlines.open(ner_json) as reader:
+        for obj in reader:
+            doc_ents = {}
+            for sent in obj['sents']:
+                for ent in sent['entities']:
+                    doc_ents.setdefault(ent['type'], []).append(ent['text'])
+            yield obj['doc_id'], {type: filter_entities(entlist) for type, entlist in doc_ents.items()}
+
+
+@timer
+def build_meta_store(metadata_csv, ner_json, entity_types, out, batch_size=1000):
+    """
+    Writes the per-sha records (entity string, publish year, journal) to the sqlite file 'out'.
+    The NER file is streamed twice: once to count how often each entity occurs in the corpus,
+    then to write each record, keeping only entities of 'entity_types' that occur more than once.
+    Peak memory is the csv row map plus the entity counts, independent of the NER file's size.
+    """
+    rows = read_metadata_rows(metadata_csv)
+
+    ent_freqs = Counter()
+    for doc_id, doc_ents in stream_ner_entities(ner_json):
+        if doc_id in rows:
+            for entlist in doc_ents.values():
+                ent_freqs.update(entlist)
+
+    if os.path.isfile(out):
+        os.remove(out)
+    conn = sqlite3.connect(out)
+    conn.execute("CREATE TABLE meta (sha TEXT PRIMARY KEY, ents TEXT, publish_time INTEGER, journal TEXT)")
+    batch = []
+    for doc_id, doc_ents in stream_ner_entities(ner_json):
+        if doc_id in rows:
+            sha, publish_time, journal = rows.pop(doc_id)
+            ents = [ent for type, entlist in doc_ents.items() if type in entity_types
+                    for ent in entlist if ent_freqs[ent] > 1]
+            batch.append((sha, untokenize(ents), int(publish_time), journal))
+        if len(batch) >= batch_size:
+            conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)", batch)
+    # papers in the metadata without any NER output still get their year and journal
+    conn.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?, ?, ?)",
+                     ((sha, '', int(publish_time), journal) for sha, publish_time, journal in rows.values()))
+    conn.commit()
+    conn.close()
+
+
+class MetaStore:
+    """
+    Read access to the store written by build_meta_store. get(sha) returns a dict with the
+    'ents', 'publish_time' and 'journal' of a paper, or None. The sqlite connection is opened
+    lazily in each process, so a MetaStore can be handed to worker processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def get(self, sha):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path)
+            self._pid = os.getpid()
+        row = self._conn.execute("SELECT ents, publish_time, journal FROM meta WHERE sha = ?", (sha,)).fetchone()
+        if row is None:
+            return None
+        return {"ents": row[0], "publish_time": row[1], "journal": row[2]}
+
+    def __getstate__(self):
+        return {"path": self.path, "_conn": None, "_pid": None}
@@ -0,0 +1,165 @@
+"""metrics.py
+This module collects measurements of an index build: time spent in each stage, counters
+(documents, bytes and requests sent to elasticsearch, retries, ...) and peak memory, and writes
+them as a JSON report per build, so builds of different corpus releases can be compared.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import json, os, sys, threading, time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class BuildMetrics:
+    """
+    Accumulated stage timings ({name: [seconds, calls]}) and counters. Safe to update from the
+    bulk loader's threads. Worker processes each have their own copy: they send snapshot()
+    back with their results and the parent merge()s it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.stages = defaultdict(lambda: [0.0, 0])
+        self.counters = Counter()
+
+    def record(self, name, seconds, calls=1):
+        with self.lock:
+            stage = self.stages[name]
+            stage[0] += seconds
+            stage[1] += calls
+
+    @contextmanager
+    def stage(self, name):
+        """ Times the body of a with block as one call of stage 'name'. """
+        start_t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_t)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        with self.lock:
+            return {"stages": {name: list(stage) for name, stage in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+    def merge(self, snapshot):
+        for name, (seconds, calls) in snapshot['stages'].items():
+            self.record(name, seconds, calls)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+
+    def report(self, **info):
+        """ The measurements so far, with 'info' (e.g. the build's settings) added at the top level. """
+        snapshot = self.snapshot()
+        elapsed_t = time.time() - self.started
+        indexed = snapshot['counters'].get('docs.indexed', 0)
+        bulk_seconds = snapshot['stages'].get('bulk_load', [0.0])[0]
+        return dict(info,
+                    started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    elapsed_seconds=elapsed_t,
+                    docs_per_sec=indexed / bulk_seconds if bulk_seconds else 0.0,
+                    rss_high_water_mb=rss_high_water(),
+                    stages={name: {"seconds": seconds, "calls": calls}
+                            for name, (seconds, calls) in sorted(snapshot['stages'].items())},
+                    counters=dict(sorted(snapshot['counters'].items())))
+
+    def write_report(self, report_dir, **info):
+        """ Writes report() to a timestamped JSON file in 'report_dir' and returns its path. """
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, 'build_%s.json' % time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)))
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=2)
+        return path
+
+
+# the measurements of the current process
+build_metrics = BuildMetrics()
+
+
+def rss_high_water():
+    """ Peak resident memory, in MB, of this process and of its largest finished child process (workers). """
+    if resource is None:
+        return {}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+
+
+def instrument_transport(es, metrics=build_metrics):
+    """
+    Counts the requests an Elasticsearch client sends: time spent in and bytes sent by bulk
+    requests, documents rejected by a full bulk queue (which streaming_bulk retries when
+    --bulk_retries is set), and connection failures retried by the transport.
+    """
+    transport = es.transport
+    perform_request, mark_dead = transport.perform_request, transport.mark_dead
+
+    def counted_request(method, url, *args, **kwargs):
+        if not url.endswith('/_bulk'):
+            return perform_request(method, url, *args, **kwargs)
+        body = kwargs.get('body') or ''
+        metrics.count('bulk.requests')
+        metrics.count('bulk.bytes_sent', len(body.encode('utf-8') if isinstance(body, str) else body))
+        with metrics.stage('bulk.transport'):
+            response = perform_request(method, url, *args, **kwargs)
+        metrics.count('bulk.rejected_docs', sum(1 for item in response.get('items', [])
+                                                for result in item.values() if result.get('status') == 429))
+        return response
+
+    def counted_mark_dead(connection):
+        metrics.count('transport.retries')
+        return mark_dead(connection)
+
+    transport.perform_request = counted_request
+    transport.mark_dead = counted_mark_dead
+    return es
+
+
+@contextmanager
+def profiled(profiler, report_dir):
+    """
+    Runs the body of a with block under 'profiler' ('cprofile' or 'pyinstrument', or None to
+    not profile) and writes its output to 'report_dir'. Only the main process is profiled;
+    work done in worker processes shows up as time spent waiting on the pool.
+    """
+    if profiler is None:
+        yield
+        return
+    os.makedirs(report_dir, exist_ok=True)
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler  # optional: pip install pyinstrument
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(os.path.join(report_dir, 'profile_%s.html' % stamp), 'w') as f:
+                f.write(profile.output_html())
+    else:
+        import cProfile, pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = os.path.join(report_dir, 'profile_%s.prof' % stamp)
+            profile.dump_stats(path)
+            pstats.Stats(path).sort_stats('cumulative').print_stats(20)
@@ -0,0 +1,142 @@
+"""neighbours.py
+This module precomputes, as a stage of the index pipeline, the papers most similar to each paper
+by their entities, so 'more like this' by entities is a table lookup instead of an Elasticsearch
+more_like_this query. Papers are rows of a sparse TF-IDF matrix over their filtered entities
+(CSR numpy arrays, as in citation_graph/graph.py), and cosine similarities are computed a block
+of rows at a time, keeping the top k neighbours of each row.
+project: CORD-19 COSI134A FINAL PROJECT
+date: May 2020
+authors: Samantha Richards, Molly Moran, Emily Fountain
+"""
+
+import os
+from collections import Counter
+import numpy as np
+
+
+def tfidf_matrix(docs, max_df=0.2):
+    """
+    Builds the L2-normalized TF-IDF matrix of 'docs', a list of entity lists, as CSR arrays
+    (indptr, indices, data). Entities in a single paper, or in more than 'max_df' of all papers,
+    cannot tell papers apart and are left out (like more_like_this's min/max_doc_freq).
+    """
+    vocab = {}
+    rows, cols, counts = [], [], []
+    for r, ents in enumerate(docs):
+        for ent, count in Counter(ents).items():
+            rows.append(r)
+            cols.append(vocab.setdefault(ent, len(vocab)))
+            counts.append(count)
+    n = len(docs)
+    rows, cols = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+    counts = np.array(counts, dtype=np.float64)
+
+    df = np.bincount(cols, minlength=len(vocab))
+    keep = ((df > 1) & (df <= max_df * n))[cols]
+    rows, cols, counts = rows[keep], cols[keep], counts[keep]
+
+    # sublinear term frequency, weighted by inverse document frequency, then unit length rows
+    data = (1 + np.log(counts)) * np.log(n / df[cols])
+    norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=n))
+    data = data / norms[rows]
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols, data
+
+
+def top_k_similar(indptr, indices, data, k=100, block_elements=2 ** 24, block_pairs=2 ** 21):
+    """
+    Returns (neighbours, scores): for each row of the CSR matrix, the k other rows with the highest
+    cosine similarity, best first, as (rows x k) arrays padded with -1 and 0. Similarities are
+    computed for blocks of rows against the whole matrix, through its transpose. A block holds at
+    most 'block_elements' scores and pairs at most 'block_pairs' (entity of a block row, row sharing
+    that entity) products, unless a single row alone exceeds them.
+    """
+    n = len(indptr) - 1
+    k = max(0, min(k, n - 1))
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if k == 0 or len(indices) == 0:
+        return neighbours, scores
+
+    # transpose: the rows containing each entity, with their weights
+    row_of = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    postings, posting_data = row_of[order], data[order]
+    col_ptr = np.zeros(indices.max() + 2, dtype=np.int64)
+    np.cumsum(np.bincount(indices), out=col_ptr[1:])
+
+    # products each row takes: the number of rows containing each of its entities, summed
+    row_pairs = np.cumsum(np.bincount(row_of, weights=np.diff(col_ptr)[indices], minlength=n)).astype(np.int64)
+    block_rows = max(1, block_elements // n)
+    start = 0
+    while start < n:
+        done = row_pairs[start - 1] if start else 0
+        stop = max(start + 1, min(start + block_rows, np.searchsorted(row_pairs, done + block_pairs, side='right')))
+        lo, hi = indptr[start], indptr[stop]
+        cols = indices[lo:hi]
+
+        # pair each entity of the block's rows with every row containing that entity
+        lengths = col_ptr[cols + 1] - col_ptr[cols]
+        offsets = np.repeat(col_ptr[cols] - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        block_row = np.repeat(row_of[lo:hi] - start, lengths)
+        weights = np.repeat(data[lo:hi], lengths) * posting_data[offsets]
+        block = np.bincount(block_row * n + postings[offsets], weights=weights,
+                            minlength=(stop - start) * n).reshape(stop - start, n)
+        block[np.arange(stop - start), np.arange(start, stop)] = 0  # a paper is not its own neighbour
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        best_first = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, best_first, axis=1)
+        top_scores = np.take_along_axis(top_scores, best_first, axis=1)
+        neighbours[start:stop] = np.where(top_scores > 0, top, -1)
+        scores[start:stop] = np.where(top_scores > 0, top_scores, 0)
+        start = stop
+    return neighbours, scores
+
+
+class EntityNeighbours:
+    """
+    The precomputed entity neighbours of every document: row 'doc_id' of 'neighbours' holds the
+    document ids most similar to doc_id, best first and padded with -1, and 'scores' their cosine
+    similarities. Saved as two .npy files, which load memory-mapped.
+    """
+    def __init__(self, neighbours, scores):
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @classmethod
+    def build(cls, docs, doc_ids, k=100, max_df=0.2):
+        """ Computes the neighbours of each entity list in 'docs', where docs[n] belongs to document doc_ids[n]. """
+        neighbours, scores = top_k_similar(*tfidf_matrix(docs, max_df), k=k)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        table = np.full((doc_ids.max() + 1 if len(doc_ids) else 0, neighbours.shape[1]), -1, dtype=np.int32)
+        table[doc_ids] = np.where(neighbours >= 0, doc_ids[neighbours], -1)
+        table_scores = np.zeros(table.shape, dtype=np.float32)
+        table_scores[doc_ids] = scores
+        return cls(table, table_scores)
+
+    def save(self, neighbours_dir):
+        """ Writes the tables to 'neighbours_dir', replacing each file in one step so readers never see a partial one. """
+        os.makedirs(neighbours_dir, exist_ok=True)
+        for name in ('neighbours', 'scores'):
+            path = os.path.join(neighbours_dir, name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, neighbours_dir, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(os.path.join(neighbours_dir, name + '.npy'), mmap_mode=mmap_mode)
+                     for name in ('neighbours', 'scores')])
+
+    def similar(self, doc_id):
+        """ (ids, scores) of doc_id's neighbours, best first, or None if doc_id is newer than the tables. """
+        if not 0 <= doc_id < len(self.neighbours):
+            return None
+        row = np.asarray(self.neighbours[doc_id])
+        found = row >= 0
+        return row[found].tolist(), np.asarray(self.scores[doc_id])[found].tolist()
@@ -6,19 +6,153 @@ authors: Samantha Richards, Molly Moran, Emily Fountain
 """
 
 from flask import *
+from elasticsearch import NotFoundError, RequestError
 from elasticsearch_dsl import Q
+from elasticsearch_dsl.response import Response as SearchResponse
 from index import Article
+from cord_19_ems.citation_graph.graph import CitationGraph
+from cord_19_ems.es_module.neighbours import EntityNeighbours
+from cord_19_ems.es_module.cache import MemoryCache, SQLiteCache, cache_key
+from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl.utils import AttrList, AttrDict
 from elasticsearch_dsl import Search
-import re, argparse
+import base64, binascii, json, re, os, time, argparse
 
 app = Flask(__name__)
-index_name = ""
 
-# initialize global variables for rendering page
-tmp_text = ""
-tmp_authors = ""
-gresults = {}
+# configuration; read from the environment when served by a WSGI server such as gunicorn
+# (e.g. `gunicorn -w 4 query:app`), and from the command line when run directly
+index_name = os.environ.get('CORD19_INDEX_NAME', 'another_covid_index')
+graph_dir_path = os.environ.get('CORD19_GRAPH_DIR', 'graph')
+citation_graph = None  # loaded on first use, once per worker process
+# entity neighbours precomputed by index.py, in a directory per index version; without them,
+# 'more like this' by entities runs a more_like_this query
+neighbours_dir_path = os.environ.get('CORD19_NEIGHBOURS_DIR', 'neighbours')
+entity_neighbours = None  # (index version, neighbours) loaded on first use, and again when the version changes
+
+# result page cache: 'memory' (per worker process), 'sqlite' (a file shared by workers) or 'none'
+cache_backend = os.environ.get('CORD19_CACHE', 'memory')
+cache_path = os.environ.get('CORD19_CACHE_PATH', 'result_cache.db')
+cache_size = int(os.environ.get('CORD19_CACHE_SIZE', 1024))
+cache_ttl = float(os.environ.get('CORD19_CACHE_TTL', 300))
+result_cache = None  # created on first use, once per worker process
+
+# highlighting of result pages: the highlighter ('unified', 'fvh' or 'plain') and the length of the
+# abstract fragment shown, in characters (0 highlights the whole abstract, which is slow for long ones)
+highlighter = os.environ.get('CORD19_HIGHLIGHTER', 'unified')
+highlight_fragment_size = int(os.environ.get('CORD19_HIGHLIGHT_FRAGMENT_SIZE', 300))
+
+# the concrete index behind index_name is looked up at most this often (in seconds);
+# when it changes (e.g. index.py moved the alias), the result cache is cleared
+VERSION_CHECK_INTERVAL = 5
+current_version = {"name": None, "mapping": 'full', "checked": 0.0}
+
+# fields each view reads from _source. body_text and the citations are large, so they are only
+# fetched by the views that use them: the document page gets its header and the names of the body
+# sections (the sections themselves are loaded by DOCUMENT_PARTS), and 'more like this' only needs
+# the reference article's citation keys.
+SOURCE_FIELDS = {
+    'serp': ['title', 'abstract', 'snippet', 'ents', 'pr'],
+    'more_like_this': ['title', 'abstract', 'snippet', 'ents', 'pr'],
+    'reference': ['title', 'citation_keys'],
+    'title': ['title'],
+    'document': ['title', 'id_num', 'publish_time', 'journal', 'authors', 'abstract', 'body.name'],
+    'export': ['title', 'authors', 'publish_time', 'journal', 'abstract', 'pr', 'ents'],
+}
+
+# parts of the document page loaded by the page itself after its header, as paginated JSON, so
+# the page is as quick to serve for a long, highly cited paper as for a short one. The lists are nested
+# in the full mapping profile, and a page of one is fetched as nested inner hits; in the lean profile
+# the list is read from _source and sliced.
+# {part: (the _source list it pages through, the fields read from it, items per page)}
+DOCUMENT_PARTS = {
+    'sections': ('body', ['body.name', 'body.text'], 5),
+    'references': ('citations', ['citations.title', 'citations.year', 'citations.in_corpus',
+                                 'citations.authors'], 50),
+    'cited_by': ('cited_by', ['cited_by.id', 'cited_by.text'], 20),
+}
+
+# largest number of citations of the reference article used by 'more like this'
+# (Elasticsearch's indices.query.bool.max_clause_count defaults to 1024)
+MAX_CITATION_CLAUSES = 1000
+
+# pages reached by a previous/next link are searched in a point in time (a snapshot of the index,
+# kept open for PIT_KEEP_ALIVE after each use and closed on the last page) with search_after from a
+# cursor carried in the link, so deep pages cost the same as the first ones, are not limited to the
+# first 10,000 hits, and do not shift while index.py moves the alias to a new index version.
+# pages reached without a cursor (e.g. the first page) are plain searches and open no point in time.
+# needs Elasticsearch 7.12 or later (for the _shard_doc tiebreaker)
+PIT_KEEP_ALIVE = '5m'
+# hits per search request of /export
+EXPORT_BATCH_SIZE = 1000
+
+# the fields that define a query. They are posted by the search forms and carried in the url
+# by the page links, so no query state is kept in the app between requests.
+QUERY_FIELDS = ['type', 'query', 'authors', 'in_english', 'search_operator', 'mindate', 'maxdate', 'ent']
+
+
+def es_call(func, *args, **kwargs):
+    """ Runs one Elasticsearch request, counting it towards the current request's total. """
+    if has_app_context():  # not when called from batch_query.py
+        g.es_calls = g.get('es_calls', 0) + 1
+    return func(*args, **kwargs)
+
+
+# report how many Elasticsearch requests each page took, so SERP latency can be tracked,
+# and whether it was served from the result cache
+@app.after_request
+def report_es_calls(response):
+    response.headers['X-ES-Calls'] = str(g.get('es_calls', 0))
+    if 'cache_status' in g:
+        response.headers['X-Cache'] = g.cache_status
+    return response
+
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None and cache_backend != 'none':
+        if cache_backend == 'sqlite':
+            result_cache = SQLiteCache(cache_path, cache_size, cache_ttl)
+        else:
+            result_cache = MemoryCache(cache_size, cache_ttl)
+    return result_cache
+
+
+def index_version():
+    """
+    The concrete indices behind index_name, each with the update counter index.py keeps in its
+    mapping's _meta ('name:update', comma separated), re-checked every VERSION_CHECK_INTERVAL
+    seconds. It changes when the alias moves and when the live index is updated in place.
+    """
+    if time.time() - current_version['checked'] > VERSION_CHECK_INTERVAL:
+        es = connections.get_connection()
+        version, current_version['mapping'] = parse_version(es_call(es.indices.get_mapping, index=index_name))
+        if current_version['name'] is not None and version != current_version['name'] \
+                and get_result_cache() is not None:
+            get_result_cache().clear()
+        current_version['name'] = version
+        current_version['checked'] = time.time()
+    return current_version['name']
+
+
+def parse_version(mappings):
+    """ The index version string and the mapping profile of the newest index, from a get_mapping response. """
+    version = ','.join(f"{name}:{mapping['mappings'].get('_meta', {}).get('update', 0)}"
+                       for name, mapping in sorted(mappings.items()))
+    return version, mappings[max(mappings)]['mappings'].get('_meta', {}).get('mapping', 'full')
+
+
+def index_mapping():
+    """ The mapping profile ('full' or 'lean') of the newest index version behind index_name. """
+    index_version()
+    return current_version['mapping']
+
+
+# hit/miss counts of this worker's result cache
+@app.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    cache = get_result_cache()
+    return jsonify(cache.stats() if cache is not None else {})
 
 
 @app.route("/")
@@ -30,129 +164,73 @@ def search():
 @app.route("/results/<page>", methods=['GET', 'POST'])
 def results(page):
     """ Handles rendering results for multple types of queries: Search queries and 'More Like This' queries. """
-    global tmp_text
-    global tmp_authors
-    global tmp_search_type
-    global tmp_min
-    global tmp_max
-    global tmp_lang
-    global gresults
-    global tmp_doc_id
-    global tmp_search_operator
-    global tmp_ent
-
-    # instantiate a search object
-    s = Search(index=index_name)
-
     # make sure 'page' id is an int
     if type(page) is not int:
         page = int(page.encode('utf-8'))
 
-    # initialize variables differently depending on whether method is GET or POST
-    if request.method == 'POST':
-        search_type = request.form['type']  # 'more_like_this' or 'search'
-        tmp_search_type = search_type
-
-        # More Like This Queries
-        if search_type !="search":
-            doc_id = request.form['query']
-            tmp_doc_id = doc_id
-            if search_type=='match_entity':
-                ent = request.form['ent']
-                tmp_ent = ent
-
-        # Standard Queries
-        else:
-            text_query = request.form['query']
-            authors_query = request.form['authors']
-            lang_query = request.form['in_english']
-            search_operator = request.form.get('search_operator')  # conjunctive or disjunctive search
-
-            # handle date range
-            mindate_query = request.form['mindate']
-            mindate_query = int(mindate_query) if len(mindate_query) > 0 else 0
-            maxdate_query = request.form['maxdate']
-            maxdate_query = int(maxdate_query) if len(maxdate_query) > 0 else 99999
-
-            # update global variable template data
-            tmp_text = text_query
-            tmp_authors = authors_query
-            tmp_min = mindate_query
-            tmp_max = maxdate_query
-            tmp_lang = lang_query
-            tmp_search_operator = search_operator
-
-    else:  # request.method == 'GET':
-        search_operator = tmp_search_operator
-        search_type = tmp_search_type
-        text_query = tmp_text
-        authors_query = tmp_authors
-        mindate_query = tmp_min if tmp_min > 0 else ""
-        maxdate_query = tmp_max if tmp_max < 99999 else ""
-        lang_query = tmp_lang
+    # read the query from the form (POST) or the url (GET, when paging)
+    state = query_state(request.values)
+
+    # pages reached by a previous/next link carry the cursor they start from
+    cursor = request.values.get('cursor', '')
+
+    # serve the page from the cache when the same query was run against the current index
+    # (pages reached with a cursor are not cached: their cursor is tied to a point in time)
+    cache = get_result_cache()
+    if cache is None or cursor:
+        return render_results(page, state, cursor)
+    key = cache_key(index_version(), state, page)
+    html = cache.get(key)
+    g.cache_status = 'miss' if html is None else 'hit'
+    if html is None:
+        html = render_results(page, state)
+        cache.put(key, html)
+    return html
+
+
+def render_results(page, state, cursor=''):
+    """ Runs the query described by 'state' and renders the requested page of results, starting from 'cursor' if
+    the page was reached by a previous/next link. """
+    # instantiate a search object
+    s = Search(index=index_name)
+    search_type = state['type']  # 'search', 'more_like_this_citations', 'more_like_this_entities' or 'match_entity'
 
     # ---------------NON-STANDARD SEARCH TYPES--------------- #
     # find me papers with similar citations
     if search_type == 'more_like_this_citations':
-        return more_like_this(page, s, tmp_doc_id)
+        return more_like_this(page, s, state['query'], state, cursor)
     # find me papers with similar entities
     elif search_type == 'more_like_this_entities':
-        return more_like_this_ents(page, s, tmp_doc_id)
+        return more_like_this_ents(page, s, state['query'], state, cursor=cursor)
     # find me papers containing this specific entity
     elif search_type == 'match_entity':
-        return more_like_this_ents(page, s, tmp_doc_id, single_ent=True, ent=tmp_ent)
-
-    # ---------------STANDARD SEARCH--------------- #
-    shows = {'text': text_query, 'authors': authors_query, 'maxdate': maxdate_query, 'mindate': mindate_query,
-             'lang': lang_query}
-
-    # match language
-    if lang_query == True:
-        s = s.filter('match', in_english=lang_query)
-
-    # publish time filter
-    s = s.filter('range', publish_time={'gte': mindate_query, 'lte': maxdate_query})
-
-    # free text search
-    if len(text_query) > 0:
-        s = s.query('multi_match', query=text_query, type='cross_fields',
-                fields=['title', 'abstract', 'body_text', 'anchor_text'], operator=search_operator)
+        return more_like_this_ents(page, s, state['query'], state, single_ent=True, ent=state['ent'], cursor=cursor)
 
-    # authors filter
-    if len(authors_query) > 0:
-        s = filter_for_authors(authors_query, s)
+    text_query = state['query']
+    authors_query = state['authors']
+    lang_query = state['in_english']
+    search_operator = state['search_operator']  # conjunctive or disjunctive search
 
-    # if no query is passed in, return all documents and
-    # return in descending order of pagerank scores
-    else:
-        s = s.query('match_all')
-        s = s.sort()
-        s = s.sort(
-            {"pr": {"order": "desc"}}
-        )
+    # handle date range
+    mindate_query = int(state['mindate']) if len(state['mindate']) > 0 else 0
+    maxdate_query = int(state['maxdate']) if len(state['maxdate']) > 0 else 99999
 
-    # highlight
-    s = s.highlight_options(pre_tags='<mark>', post_tags='</mark>')
-    s = s.highlight('abstract', fragment_size=999999999, number_of_fragments=1)
-    s = s.highlight('title', fragment_size=999999999, number_of_fragments=1)
+    # ---------------STANDARD SEARCH--------------- #
+    shows = {'text': text_query, 'authors': authors_query, 'maxdate': state['maxdate'], 'mindate': state['mindate'],
+             'lang': lang_query}
 
-    # determine the subset of results to display (based on current <page> value)
-    start = 0 + (page - 1) * 10
-    end = 10 + (page - 1) * 10
+    s = serp_search(s, text_query, authors_query, mindate_query, maxdate_query, lang_query, search_operator)
 
-    # execute search and return results in specified range.
-    response = s[start:end].execute()
+    # execute search and return results in specified range (based on current <page> value).
+    response, cursors = paginate(s, page, cursor)
     result_num = response.hits.total['value']
 
     # get data for each hit, to display on results page
     results = populate_results(response)
 
-    # make the result list available globally
-    gresults = results
-
     if result_num > 0:
-        return render_template('page_SERP.html', results=results,
-                               res_num=result_num, page_num=page, queries=shows)
+        return render_template('page_SERP.html', results=results, res_num=result_num, page_num=page,
+                               cursors=cursors, queries=shows, state=state)
     else:
         message = []
         if len(text_query) > 0:
@@ -161,29 +239,16 @@ def results(page):
             message.append('Cannot find authors: ' + authors_query)
 
         return render_template('page_SERP.html', results=message, res_num=result_num,
-                               page_num=page, queries=shows)
+                               page_num=page, cursors=cursors, queries=shows, state=state)
 
 
-def more_like_this_ents(page, s, doc_id, single_ent=False, ent=None):
-    global gresults
-    article = Article.get(id=doc_id, index=index_name)
+def more_like_this_ents(page, s, doc_id, state, single_ent=False, ent=None, cursor=''):
+    article = es_call(Article.get, id=doc_id, index=index_name, _source_includes=SOURCE_FIELDS['title'])
     title = article['title']
 
-    # find pages containing a single specific entity
-    if single_ent:
-        s = s.query('multi_match', query=ent, fields=['ents'], operator='and', type='cross_fields')
-
-    # find pages containing similar entities to doc_id
-    else:
-        q = Q("more_like_this", fields=["ents"], like=[{"_index": index_name, "_id": doc_id}], min_term_freq=1)
-        s = s.query(q)
-
-    # display results by 10
-    start = 0 + (page - 1) * 10
-    end = 10 + (page - 1) * 10
-
     # execute search and return results in specified range.
-    response = s[start:end].execute()
+    neighbours = None if single_ent else get_entity_neighbours()
+    response, cursors = paginate(entity_search(s, doc_id, single_ent, ent, neighbours), page, cursor)
     result_num = response.hits.total['value']
 
     # get data for each hit, to display on results page
@@ -193,68 +258,265 @@ def more_like_this_ents(page, s, doc_id, single_ent=False, ent=None):
     for i in results:
         results[i]['overlap'] = ""
 
-    # make the result list available globally
-    gresults = results
-
     # get the total number of matching results
     return render_template('more_like_this.html', results=results, doc_id=doc_id, title=title,
-                           res_num=result_num, page_num=page)
+                           res_num=result_num, page_num=page, cursors=cursors, state=state)
 
 
-def more_like_this(page, s, doc_id):
-    global gresults
+def more_like_this(page, s, doc_id, state, cursor=''):
 
     # Grab the actual article from the index
-    article = Article.get(id=doc_id, index=index_name)
+    article = es_call(Article.get, id=doc_id, index=index_name, _source_includes=SOURCE_FIELDS['reference'])
     title = article['title']
 
-    # grab a list of citation titles for this article, for comparison
-    citations = set([citation['title'].lower() for citation in article['citations']])
-
-    # execute a query for articles containing matching citations
-
-    q = Q('bool',
-          should=[{"match_phrase": {'citations.title': citation} for citation in citations}],
-          minimum_should_match=1)
-    s = s.query("nested", path="citations", query=q)
-
-    # display results by 10
-    start = 0 + (page - 1) * 10
-    end = 10 + (page - 1) * 10
-
-    # execute search and return results in specified range.
-    response = s[start:end].execute()
+    # execute a query for articles sharing citations with this one, ranked by the number they share,
+    # and return results in specified range.
+    s = citation_search(s, doc_id, list(getattr(article, 'citation_keys', [])))
+    response, cursors = paginate(s, page, cursor)
     result_num = response.hits.total['value']
 
     # get data for each hit, to display on results page
     results = populate_results(response)
+    set_citation_overlaps(results)
+
+    # get the total number of matching results
+    return render_template('more_like_this.html', results=results, doc_id=doc_id, title=title,
+                           res_num=result_num, page_num=page, cursors=cursors, state=state)
+
+
+def serp_search(s, text_query, authors_query, mindate_query, maxdate_query, lang_query, search_operator):
+    """ The standard search, with the fields and highlighting shown on the results page. """
+    s = build_search(s, text_query, authors_query, mindate_query, maxdate_query, lang_query, search_operator)
+    s = s.source(includes=SOURCE_FIELDS['serp'])
+
+    return highlight(s, highlighter, highlight_fragment_size)
+
+
+def highlight(s, highlighter='unified', fragment_size=300):
+    """
+    Highlights the query terms in the title and abstract shown on the results page. Titles are
+    highlighted whole, abstracts as their best fragment of about 'fragment_size' characters (the
+    start of the abstract when no term matches), so the work per hit does not grow with the
+    abstract. 'fvh' needs the term vectors indexed by index.py --highlighting term_vectors; the
+    unified highlighter reads indexed offsets or term vectors when there are any, and re-analyzes
+    the field otherwise.
+    """
+    s = s.highlight_options(type=highlighter, pre_tags='<mark>', post_tags='</mark>')
+    s = s.highlight('title', number_of_fragments=0)
+    if fragment_size:
+        s = s.highlight('abstract', fragment_size=fragment_size, number_of_fragments=1, no_match_size=fragment_size)
+    else:
+        s = s.highlight('abstract', number_of_fragments=0)
+    return s
 
-    if doc_id in results.keys():
-        del results[doc_id]
 
+def entity_search(s, doc_id, single_ent=False, ent=None, neighbours=None):
+    """ Papers containing the entity 'ent' if single_ent is set, otherwise papers with entities similar to doc_id's,
+    from the precomputed EntityNeighbours 'neighbours' if given. """
+    # find pages containing a single specific entity
+    if single_ent:
+        s = s.query('multi_match', query=ent, fields=['ents'], operator='and', type='cross_fields')
 
-    # calculate percentage citation overlap between each result article and reference article
-    # use this to display on the page
-    get_citation_overlap_scores(citations, results)
+    # find pages containing similar entities to doc_id: look them up in the precomputed neighbours if
+    # there are any for doc_id, ranked by their similarity, otherwise run a more_like_this query
+    else:
+        similar = neighbours.similar(int(doc_id)) if neighbours is not None and doc_id.isdigit() else None
+        if similar is not None:
+            q = Q('bool', should=[Q('constant_score', filter=Q('ids', values=[str(i)]), boost=score)
+                                  for i, score in zip(*similar)], minimum_should_match=1)
+        else:
+            q = Q("more_like_this", fields=["ents"], like=[{"_index": index_name, "_id": doc_id}], min_term_freq=1)
+        s = s.query(q)
+    return s.source(includes=SOURCE_FIELDS['serp'])
 
-    # make the result list available globally
-    results =  [results[i] for i in results if results[i]['overlap'] !=0]
-    gresults = results
 
-    # get the total number of matching results
-    return render_template('more_like_this.html', results=results, doc_id=doc_id, title=title,
-                           res_num=result_num, page_num=page)
+def citation_search(s, doc_id, citation_keys):
+    """ Papers other than doc_id that share citations with it. Each shared citation scores 1, so
+    results are ranked by citation overlap (ties broken by pagerank) and paginate in order. """
+    # one constant score clause per citation, up to Elasticsearch's default limit on bool clauses
+    q = Q('bool',
+          should=[Q('constant_score', filter=Q('term', citation_keys=key)) for key in citation_keys[:MAX_CITATION_CLAUSES]],
+          minimum_should_match=1,
+          must_not=[Q('ids', values=[doc_id])])
+    s = s.query(q).sort('_score', {'pr': {'order': 'desc'}})
+    # sorting on a field stops Elasticsearch from computing scores unless asked to
+    s = s.extra(track_scores=True)
+    return s.source(includes=SOURCE_FIELDS['more_like_this'])
 
 
-def get_citation_overlap_scores(citations, results):
-    """ Finds overlapping citations between two documents.
-    Used for display on 'more like this' page. """
+def page_slice(s, page):
+    """ Restricts a search to the 10 results shown on page number 'page'. """
+    start = 0 + (page - 1) * 10
+    end = 10 + (page - 1) * 10
+    return s[start:end]
+
+
+def paginate(s, page, cursor=''):
+    """
+    Runs search s for result page number 'page'. Returns the response, with its hits in display
+    order, and the cursors of the previous and next pages. A page reached without a cursor is a
+    plain search, whose next link carries a cursor with no point in time yet; the page it leads to
+    opens one. The point in time is closed on the last page.
+    """
+    cursor = decode_cursor(cursor)
+    if cursor is None:
+        response = es_call(page_slice(s, page).execute)
+        return response, page_cursors(response.hits.total, len(response.hits), page)
+
+    es = connections.get_connection()
+    pit_id = cursor['pit']
+    try:
+        if pit_id is None:
+            pit_id = es_call(es.open_point_in_time, index=index_name, keep_alive=PIT_KEEP_ALIVE)['id']
+        raw = es_call(es.search, body=pit_search(s, pit_id, page, cursor).to_dict())
+    except NotFoundError:
+        if cursor['pit'] is None:
+            raise
+        # the point in time expired: continue after the cursor's hits in a new one
+        pit_id = es_call(es.open_point_in_time, index=index_name, keep_alive=PIT_KEEP_ALIVE)['id']
+        raw = es_call(es.search, body=pit_search(s, pit_id, page, cursor).to_dict())
+    response, cursors = pit_response(s, raw, page, cursor)
+    if not cursors['next']:
+        es_call(es.close_point_in_time, body={'id': raw['pit_id']})
+    return response, cursors
+
+
+def page_cursors(total, n_hits, page, pit_id=None, first=None, last=None):
+    """ Cursors of the pages before and after a page of 'n_hits' hits ('' when there is none): after the sort
+    values 'last' of its last hit, and before those of its first hit, 'first', in point in time pit_id. Without
+    a point in time, the next page opens one and the previous page is found by its number. """
+    more = total['relation'] == 'gte' or page * 10 < total['value']
+    return {'previous': encode_cursor(pit_id, first, 'previous') if page > 1 and n_hits and first else '',
+            'next': encode_cursor(pit_id, last, 'next') if more and n_hits == 10 else ''}
+
+
+def pit_search(s, pit_id, page=1, cursor=None, size=10):
+    """ Search s in point in time pit_id, with a total order: hits 'size' at a time, those of page number
+    'page', or those after (or, for a 'previous' cursor, before) the hits the cursor points at. """
+    reverse = cursor is not None and cursor['direction'] == 'previous'
+    # a point in time search has no index of its own
+    s = s.index().sort(*sort_clauses(s, reverse)).extra(pit={'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE})
+    if cursor is None or cursor['after'] is None:
+        return s[(page - 1) * size:page * size]
+    return s.extra(search_after=cursor['after'])[:size]
+
+
+def sort_clauses(s, reverse=False):
+    """
+    The sort of search s (relevance if it has none) as explicit {field: order} clauses, ending with
+    the point in time's tiebreaker (_shard_doc), so every hit has a distinct sort key to search
+    after. 'reverse' flips every order: the page before a hit is the page after it in reverse.
+    """
+    clauses = []
+    for clause in s.to_dict().get('sort', ['_score']) + [{'_shard_doc': 'asc'}]:
+        field, order = (clause, None) if isinstance(clause, str) else next(iter(clause.items()))
+        order = order.get('order') if isinstance(order, dict) else order
+        order = order or ('desc' if field == '_score' else 'asc')
+        if reverse:
+            order = 'asc' if order == 'desc' else 'desc'
+        clauses.append({field: {'order': order}})
+    return clauses
+
+
+def pit_response(s, raw, page, cursor):
+    """
+    Wraps a point in time search response like Search.execute() would, with its hits in display
+    order, and returns it with the cursors of the previous and next pages. The last page's cursors
+    do not use its point in time: the caller closes it, rather than leaving it open for
+    PIT_KEEP_ALIVE, and the previous link opens a new one.
+    """
+    hits = raw['hits']['hits']
+    if cursor['direction'] == 'previous':
+        hits.reverse()
+    first, last = (hits[0]['sort'], hits[-1]['sort']) if hits else (None, None)
+    cursors = page_cursors(raw['hits']['total'], len(hits), page, raw['pit_id'], first, last)
+    if not cursors['next']:
+        cursors = page_cursors(raw['hits']['total'], len(hits), page, None, first, last)
+    return SearchResponse(s, raw), cursors
+
+
+def encode_cursor(pit_id, after, direction):
+    """ A url-safe cursor for the page after (or before, direction 'previous') the hit with sort values 'after', in
+    point in time pit_id. With no pit_id, the page opens a new point in time; with no 'after', it is found by its
+    page number. """
+    return base64.urlsafe_b64encode(json.dumps([pit_id, after, direction]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ The point in time, sort values and direction of a cursor, or None for no (or a malformed) cursor. """
+    try:
+        pit_id, after, direction = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, ValueError, TypeError, UnicodeError):
+        return None
+    return {'pit': pit_id, 'after': after, 'direction': direction}
+
+
+def set_citation_overlaps(results):
+    """ Sets the number of citations each result shares with the reference article, for display
+    on the 'more like this' page. citation_search scores each shared citation as 1. """
     for i in results:
-        result = results[i]
-        hit_citations = set([citation['title'].lower() for citation in result['citations']])
-        overlap = len(citations.intersection(hit_citations))
-        print(overlap)
-        result['overlap'] = overlap
+        results[i]['overlap'] = int(round(results[i]['score']))
+
+
+def query_search(state, article=None, neighbours=None):
+    """ The search described by 'state', of any type, without highlighting or pagination. 'article' is the
+    reference article of a 'more like this' by citations search, with its citation keys, and 'neighbours'
+    the entity neighbours used by a 'more like this' by entities search. """
+    s = Search(index=index_name)
+    doc_id = state['query']
+    if state['type'] == 'more_like_this_citations':
+        return citation_search(s, doc_id, list(article.get('citation_keys', [])))
+    if state['type'] in ('more_like_this_entities', 'match_entity'):
+        return entity_search(s, doc_id, single_ent=state['type'] == 'match_entity', ent=state['ent'],
+                             neighbours=neighbours)
+    mindate_query = int(state['mindate']) if len(state['mindate']) > 0 else 0
+    maxdate_query = int(state['maxdate']) if len(state['maxdate']) > 0 else 99999
+    return build_search(s, state['query'], state['authors'], mindate_query, maxdate_query, state['in_english'],
+                        state['search_operator'])
+
+
+def export_line(hit):
+    """ One hit of /export as a line of JSON: its id and score, and its SOURCE_FIELDS['export']. """
+    return json.dumps(dict(hit['_source'], id=hit['_id'], score=hit['_score'])) + '\n'
+
+
+def query_state(values):
+    """ Picks the fields that define a query out of the request's form or url values. """
+    state = {field: values.get(field, '') for field in QUERY_FIELDS}
+    state['type'] = state['type'] or 'search'
+    state['search_operator'] = state['search_operator'] or 'or'
+    # the forms send 'true'/'false' and batch files may give booleans; both filter the same way
+    state['in_english'] = str(state['in_english']).lower()
+    return state
+
+
+def build_search(s, text_query, authors_query, mindate_query, maxdate_query, lang_query, search_operator):
+    """ Adds the standard search's query, filters and ordering to an existing search object, s. """
+    # match language
+    if lang_query == 'true':
+        s = s.filter('match', in_english=True)
+
+    # publish time filter
+    s = s.filter('range', publish_time={'gte': mindate_query, 'lte': maxdate_query})
+
+    # free text search
+    if len(text_query) > 0:
+        s = s.query('multi_match', query=text_query, type='cross_fields',
+                fields=['title', 'abstract', 'body_text', 'anchor_text'], operator=search_operator)
+
+    # authors filter
+    if len(authors_query) > 0:
+        s = filter_for_authors(authors_query, s)
+
+    # if no query is passed in, return all documents and
+    # return in descending order of pagerank scores
+    else:
+        s = s.query('match_all')
+        s = s.sort()
+        s = s.sort(
+            {"pr": {"order": "desc"}}
+        )
+    return s
 
 
 def filter_for_authors(authors_query, s):
@@ -280,9 +542,9 @@ def populate_results(response):
     """ Fills out the results metadata for each hit in 'response' """
     results = {}
     for hit in response.hits:
+        # the body text snippet is shown in place of a missing abstract
         result = {'score': hit.meta.score,
-                  'citations': hit.citations,
-                  'body_text': hit.body_text}
+                  'body_text': getattr(hit, 'snippet', '')}
 
         # add highlighting
         if 'highlight' in hit.meta:
@@ -294,9 +556,8 @@ def populate_results(response):
             result['abstract'] = hit.abstract
 
 
-            # get entities
-        article = Article.get(id=hit.meta.id, index=index_name)
-        entlist = list(set(article['ents'].split()))  # remove duplicates
+        # get entities, from the hit's own _source rather than another request
+        entlist = list(set(getattr(hit, 'ents', '').split()))  # remove duplicates
         result['entities_list'] = [{'query': ent, 'display': re.sub(r"_", " ", ent)} for ent in entlist]
         result['id'] = hit.meta.id
         result['pr'] = hit.pr
@@ -305,18 +566,152 @@ def populate_results(response):
     return results
 
 
+# every hit of a query (the fields of the results page, as in its url), streamed as newline-delimited
+# JSON; read in batches from a point in time, so the export is consistent and not limited in size
+@app.route("/export", methods=['GET', 'POST'])
+def export():
+    state = query_state(request.values)
+    article = None
+    if state['type'] == 'more_like_this_citations':
+        article = es_call(Article.get, id=state['query'], index=index_name,
+                          _source_includes=SOURCE_FIELDS['reference']).to_dict()
+    neighbours = get_entity_neighbours() if state['type'] == 'more_like_this_entities' else None
+    s = query_search(state, article, neighbours).source(includes=SOURCE_FIELDS['export'])
+    es = connections.get_connection()
+
+    def lines():
+        pit_id = es.open_point_in_time(index=index_name, keep_alive=PIT_KEEP_ALIVE)['id']
+        cursor = None
+        try:
+            while True:
+                raw = es.search(body=pit_search(s, pit_id, cursor=cursor, size=EXPORT_BATCH_SIZE).to_dict())
+                pit_id = raw.get('pit_id', pit_id)
+                hits = raw['hits']['hits']
+                for hit in hits:
+                    yield export_line(hit)
+                if len(hits) < EXPORT_BATCH_SIZE:
+                    break
+                cursor = {'pit': pit_id, 'after': hits[-1]['sort'], 'direction': 'next'}
+        finally:
+            es.close_point_in_time(body={'id': pit_id})
+
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+
 # display a particular document given a result number
 @app.route("/documents/<res>", methods=['GET'])
 def documents(res):
-    article = Article.get(id=res, index=index_name)
+    article = es_call(Article.get, id=res, index=index_name, _source_includes=SOURCE_FIELDS['document'])
     article_title = article['title']
-    return render_template('page_targetArticle.html', article=article, title=article_title)
+    return render_template('page_targetArticle.html', article=article, title=article_title, doc_id=res)
+
+
+# one page of a document's sections, references or citing sentences, as JSON
+@app.route("/documents/<res>/<part>", methods=['GET'])
+def document_part(res, part):
+    if part not in DOCUMENT_PARTS:
+        abort(404)
+    page = request.args.get('page', 1, type=int)
+    if index_mapping() == 'full':
+        try:
+            raw = es_call(connections.get_connection().search, index=index_name,
+                          body=part_search(res, part, page).to_dict())
+        except RequestError:
+            # indices built before index.py raised max_inner_result_window only page the first 100 items
+            raw = None
+        if raw is not None:
+            if not raw['hits']['hits']:
+                abort(404)
+            return jsonify(inner_part_page(raw['hits']['hits'][0], part, page))
+    article = es_call(Article.get, id=res, index=index_name, _source_includes=DOCUMENT_PARTS[part][1])
+    return jsonify(part_page(article.to_dict(), part, page))
+
+
+def part_page(source, part, page):
+    """ Page number 'page' of a DOCUMENT_PARTS list in an article's _source, with the list's length and the
+    number of the next page (None on the last one). """
+    field, _, page_size = DOCUMENT_PARTS[part]
+    items = source.get(field, [])
+    start = max(page - 1, 0) * page_size
+    return {'part': part, 'page': page, 'total': len(items), 'items': items[start:start + page_size],
+            'next': page + 1 if start + page_size < len(items) else None}
+
+
+def part_search(res, part, page):
+    """ A search for article 'res' with page number 'page' of a DOCUMENT_PARTS list as nested inner hits, so only
+    that page is sent. The nested clause is optional, so an article with an empty list is still found. """
+    field, includes, page_size = DOCUMENT_PARTS[part]
+    inner_hits = {'from': max(page - 1, 0) * page_size, 'size': page_size, 'sort': ['_doc'], '_source': includes}
+    return Search(index=index_name).source(False).query(
+        'bool', filter=[Q('ids', values=[res])],
+        should=[Q('nested', path=field, query=Q('match_all'), inner_hits=inner_hits)])
+
+
+def inner_part_page(hit, part, page):
+    """ part_page from the article 'hit' of a part_search response. """
+    field, _, page_size = DOCUMENT_PARTS[part]
+    inner = hit.get('inner_hits', {}).get(field, {}).get('hits', {})
+    total = inner.get('total', {}).get('value', 0)
+    start = max(page - 1, 0) * page_size
+    return {'part': part, 'page': page, 'total': total, 'items': [item['_source'] for item in inner.get('hits', [])],
+            'next': page + 1 if start + page_size < total else None}
+
+
+def get_citation_graph():
+    global citation_graph
+    if citation_graph is None:
+        citation_graph = CitationGraph.load(graph_dir_path)
+    return citation_graph
+
+
+def get_entity_neighbours():
+    """ The entity neighbours of the index version behind index_name, or None if index.py wrote none for it. """
+    return version_neighbours(index_version())
+
+
+def version_neighbours(version):
+    """ The entity neighbours of the newest index in 'version' (an index_version string), loaded once per version. """
+    global entity_neighbours
+    version = version.split(',')[-1]
+    if entity_neighbours is None or entity_neighbours[0] != version:
+        # incremental updates rewrite the table in place, so it is reloaded whenever the counter moves
+        path = os.path.join(neighbours_dir_path, version.split(':')[0])
+        entity_neighbours = (version, EntityNeighbours.load(path)
+                             if os.path.isfile(os.path.join(path, 'neighbours.npy')) else None)
+    return entity_neighbours[1]
+
+
+# list the titles a document cites, and the titles citing it, from the citation graph
+@app.route("/citations/<res>", methods=['GET'])
+def citations(res):
+    article = es_call(Article.get, id=res, index=index_name, _source_includes=SOURCE_FIELDS['title'])
+    title = article['title'].lower()
+    return jsonify({'title': article['title'],
+                    'cites': get_citation_graph().successors(title),
+                    'cited_by': get_citation_graph().predecessors(title)})
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Startup and run query page for CORD-19 database")
-    parser.add_argument('--index_name', help="Name of the index which you created when you ran index.py",
-                        default="another_covid_index")
+    parser.add_argument('--index_name', help="Name of the index (alias) which you created when you ran index.py",
+                        default=index_name)
+    parser.add_argument('--graph_dir_path', help="Path to the citation graph directory written by index.py",
+                        default=graph_dir_path)
+    parser.add_argument('--neighbours_dir_path', help="Path to the entity neighbours directory written by index.py",
+                        default=neighbours_dir_path)
+    parser.add_argument('--cache', help="Result page cache backend", choices=['memory', 'sqlite', 'none'],
+                        default=cache_backend)
+    parser.add_argument('--cache_path', help="File used by the sqlite cache backend", default=cache_path)
+    parser.add_argument('--cache_size', help="Maximum number of cached result pages", type=int, default=cache_size)
+    parser.add_argument('--cache_ttl', help="Seconds a cached result page stays valid", type=float, default=cache_ttl)
+    parser.add_argument('--highlighter', help="Highlighter of result pages ('fvh' needs an index built with "
+                        "--highlighting term_vectors)", choices=['unified', 'fvh', 'plain'], default=highlighter)
+    parser.add_argument('--highlight_fragment_size', help="Characters of the abstract shown highlighted on result "
+                        "pages (0: the whole abstract)", type=int, default=highlight_fragment_size)
     args = parser.parse_args()
     index_name = args.index_name
+    graph_dir_path = args.graph_dir_path
+    neighbours_dir_path = args.neighbours_dir_path
+    cache_backend, cache_path, cache_size, cache_ttl = args.cache, args.cache_path, args.cache_size, args.cache_ttl
+    highlighter, highlight_fragment_size = args.highlighter, args.highlight_fragment_size
     app.run(debug=True)
@@ -10,7 +10,7 @@ python index.py --index_name="another_covid_index" \
 --data_dir_path="cord_19_ems/data" \
 --metadata_path="cord_19_ems/data_extras/all_sources_metadata_2020-03-13.csv" \
 --ner_path="cord_19_ems/data_extras/CORD-NER-ner.json" \
---meta_ner_path="cord_19_ems/data_extras/cross_ref_data_all_sources.json"
+--meta_ner_path="cord_19_ems/data_extras/cross_ref_data_all_sources.db"
 
 # run web search
 python query.py --index_name="another_covid_index"
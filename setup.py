@@ -3,13 +3,13 @@ from setuptools import setup
 setup(name='cord_19_ems',
       version='1.0',
       author='Molly Moran, Samantha Richards, Emily Fountain',
-      packages=['cord_19_ems', 'cord_19_ems.es_module'],
+      packages=['cord_19_ems', 'cord_19_ems.es_module', 'cord_19_ems.citation_graph'],
       description='',
       requirements=['certifi==2019.11.28',
                     'chardet==3.0.4',
                     'Click==7.0',
-                    'elasticsearch',
-                    'elasticsearch-dsl==7.1.0',
+                    'elasticsearch==7.17.13',
+                    'elasticsearch-dsl==7.4.1',
                     'Flask==1.1.1',
                     'html2text==2020.1.16',
                     'idna==2.8',
@@ -30,4 +30,6 @@ setup(name='cord_19_ems',
                     'Werkzeug==1.0.0',
                     'Wikipedia-API==0.5.3',
                     'wptools==0.4.17'],
+      # async_query.py, served by hypercorn
+      extras_require={'async': ['quart', 'hypercorn', 'elasticsearch[async]==7.17.13']},
       )
\ No newline at end of file